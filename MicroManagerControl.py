@@ -4,8 +4,70 @@ from PyQt5.QtCore import QObject, QTimer, pyqtSlot
 from PyQt5.QtGui import QImage
 
 import numpy
+import threading
 import time
-from qimage2ndarray import gray2qimage
+
+from display import DisplayConverter
+from logger import get_logger
+
+log = get_logger("mm")
+
+Z_RANGE = (0, 202)
+
+
+def clamp_z(pos: float) -> float:
+    return min(max(pos, Z_RANGE[0]), Z_RANGE[1])
+
+
+class ZMover:
+    """ Moves the Z stage from its own thread with its own core socket, so the GUI thread does not
+    wait for the stage. Only the newest target is kept: when the targets come in faster than the
+    stage moves, e.g. while the focus knob is spun, the ones in between are skipped."""
+
+    def __init__(self, bridge, event_thread=None):
+        self.event_thread = event_thread
+        self.core = bridge._construct_java_object('mmcorej.CMMCore', new_socket=True)
+        self._lock = threading.Lock()
+        self._target = None
+        self._wake = threading.Event()
+        self._stop = False
+        self.requested = 0
+        self.moved = 0
+        self._thread = threading.Thread(target=self._run, daemon=True, name="z_mover")
+        self._thread.start()
+
+    def move(self, pos: float):
+        with self._lock:
+            self._target = clamp_z(pos)
+            self.requested += 1
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop:
+            self._wake.wait()
+            self._wake.clear()
+            with self._lock:
+                target, self._target = self._target, None
+            if target is None:
+                continue
+            if self.event_thread is not None:
+                self.event_thread.blockZ = True
+            log.debug("set stage to %s", target)
+            try:
+                self.core.set_position(target)
+            except Exception as error:
+                log.warning("Could not move the stage to %s: %s", target, error)
+                continue
+            self.moved += 1
+
+    def stop(self):
+        self._stop = True
+        self._wake.set()
+        self._thread.join(timeout=2)
+        log.info("Z stage: %s targets requested, %s moves", self.requested, self.moved)
+        socket = getattr(self.core, '_socket', None)
+        if socket is not None:
+            socket.close()
 
 
 class MicroManagerControl(QObject):
@@ -23,8 +85,10 @@ class MicroManagerControl(QObject):
         self.live = self.studio.get_snap_live_manager()
         self.image_format = QImage.Format.Format_Grayscale16
         self.LUT = []
+        self.display = DisplayConverter()
         self.zPosition = self.core.get_position()
         self.move_to = self.zPosition
+        self.z_mover = ZMover(self.bridge, getattr(self, 'event_thread', None))
 
     @pyqtSlot(object)
     def set_xy_position(self, pos: tuple):
@@ -33,25 +97,30 @@ class MicroManagerControl(QObject):
     @pyqtSlot(float)
     def track_z_change(self, pos: float):
         if self.move_to == self.zPosition:
-            self.set_z_position(self.zPosition + pos)
+            self.request_z_position(self.zPosition + pos)
         new_pos = self.move_to + pos
         if new_pos < 200 and new_pos > 0:
             self.move_to = self.move_to + pos
 
     @pyqtSlot(float)
     def set_z_position(self, pos: float):
+        """ Move the stage and wait for it, e.g. before an acquisition """
         self.event_thread.blockZ = True
-        print("set stage to ", pos)
-        pos = pos if pos > 0 else 0
-        pos = pos if pos < 202 else 202
-        self.core.set_position(pos)
+        log.debug("set stage to %s", pos)
+        self.core.set_position(clamp_z(pos))
+
+    @pyqtSlot(float)
+    def request_z_position(self, pos: float):
+        """ Move the stage in the background, for the interactive controls """
+        self.z_mover.move(pos)
 
     @pyqtSlot()
     def stop_live(self):
         self.live.set_live_mode_on(False)
 
     def set_bit_depth(self):
-        bit_depth = self.core.get_image_bit_depth
+        bit_depth = self.core.get_image_bit_depth()
+        self.display.set_bit_depth(bit_depth)
         if bit_depth == 8:
             self.image_format = QImage.Format.Format_Grayscale8
         elif bit_depth == 16:
@@ -59,12 +128,14 @@ class MicroManagerControl(QObject):
 
     @pyqtSlot(object)
     def convert_image(self, image: numpy.ndarray, normalize: bool = True):
-        # t1 = time.perf_counter()
-        qimage = gray2qimage(image, normalize=normalize)
-        # print(time.perf_counter() - t1)
-        return qimage
+        """ 8 bit QImage for display, see display.py. Without normalize the levels are the
+        full range of the bit depth."""
+        if not normalize:
+            self.display.set_levels(0, 2**self.display.bit_depth - 1)
+        return self.display.convert(image, auto_levels=normalize)
 
     def close(self):
+        self.z_mover.stop()
         self.bridge.close()
 
 
@@ -1,5 +1,4 @@
 
-import pygame
 from PyQt5.QtCore import  pyqtSlot, pyqtSignal, QObject, QCoreApplication, QTimer, QThread
 import time
 import sys
@@ -11,15 +10,29 @@ CUTOFF_SPEEDUP = 80 # This is 1/ms for last value change
 CUTOFF_SPEED = 200
 
 
+def open_controller():
+    """ Load pygame and SDL and open the first joystick. This takes a while and can run in another
+    thread during startup, the device is then handed to MonogramCC."""
+    import pygame
+    pygame.init()
+    if pygame.joystick.get_count() == 0:
+        # No joysticks!
+        raise OSError('No joystick found')
+    # Use joystick #0 and initialize it
+    device = pygame.joystick.Joystick(0)
+    device.init()
+    return device
+
+
 class MonogramCC(QObject):
 
     monogram_stage_position_event = pyqtSignal(float)
     monogram_stop_live_event = pyqtSignal()
 
-    def __init__(self):
+    def __init__(self, device=None):
         super().__init__()
-        pygame.init()
-        self.initController()
+        # Without a device opened by open_controller pygame is loaded here
+        self.device = open_controller() if device is None else device
 
         self.thread = QThread()
         self.worker = self.Listener(self.device, self)
@@ -31,17 +44,6 @@ class MonogramCC(QObject):
         self.thread.start()
 
 
-    def initController(self):
-        joystick_count = pygame.joystick.get_count()
-        if joystick_count == 0:
-            # No joysticks!
-            raise OSError('No joystick found')
-        else:
-            # Use joystick #0 and initialize it
-            self.device = pygame.joystick.Joystick(0)
-            self.device.init()
-
-
     class Listener(QObject):
         monogram_stage_position_event = pyqtSignal(float)
         monogram_stop_live_event = pyqtSignal()
@@ -59,6 +61,7 @@ class MonogramCC(QObject):
             self.last_send = time.perf_counter()
 
         def startListen(self):
+            import pygame
             done = False
             print('Monogram started')
             while done == False:
@@ -0,0 +1,55 @@
+""" Compare the QThread and the asyncio event listener on the stand-in bridge: time per event
+for a burst of stage events and the time stop() takes.
+
+    python -m benchmarks.listener_bench --events 2000 --latency 0.001
+"""
+
+import argparse
+import sys
+import time
+
+from PyQt5.QtCore import QCoreApplication
+
+from event_threadQ import EventThread
+from fake_bridge import EventGenerator, FakeBridge
+
+
+def run(use_asyncio: bool, n_events: int, latency: float, port: str):
+    generator = EventGenerator(port, stage=0, xy=0, image=0, mda=0, live=0, settings=0)
+    event_thread = EventThread(address="tcp://localhost:" + port,
+                               bridge=FakeBridge(latency=latency), use_asyncio=use_asyncio)
+    listener = event_thread.listener
+    # Let the subscriber connect before publishing
+    time.sleep(0.5)
+
+    t0 = time.perf_counter()
+    for n in range(n_events):
+        generator.socket.send(generator.message('stage', n))
+    while listener.coalescer.received < n_events and time.perf_counter() - t0 < 60:
+        time.sleep(0.001)
+    per_event = (time.perf_counter() - t0)/max(listener.coalescer.received, 1)
+
+    t0 = time.perf_counter()
+    listener.stop()
+    stop_time = time.perf_counter() - t0
+    generator.stop()
+    return per_event, stop_time, listener.coalescer.received
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--events', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=0.001)
+    parser.add_argument('--port', default='5599')
+    args = parser.parse_args()
+
+    app = QCoreApplication(sys.argv)
+    for use_asyncio in [False, True]:
+        name = 'asyncio' if use_asyncio else 'QThread'
+        per_event, stop_time, received = run(use_asyncio, args.events, args.latency, args.port)
+        print(f'{name:8} {received} events, {per_event*1e6:8.1f} us/event, '
+              f'stop took {stop_time*1e3:7.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+""" Time the peak detection and fitting of the AlignmentView on synthetic images with a grid of
+spots, for the loops that were used before and for spot_analysis.find_peaks and fit_spots.
+
+    python -m benchmarks.peaks_bench --size 140 --noise 20
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from spot_analysis import alignment_quality, find_peaks, fit_spots
+
+
+def legacy(image, window_size=20):
+    """ AlignmentView.get_peaks before find_peaks """
+    data = np.copy(image).astype(float)
+    mean_image = np.mean(data)
+    data[:window_size, :] = mean_image
+    data[:, :window_size] = mean_image
+    data[-window_size:, :] = mean_image
+    data[:, -window_size:] = mean_image
+    max_value = 1000000
+    peaks = []
+    while max_value > mean_image*1.5:
+        max_value = np.max(data)
+        max_pixel = [int(pixel[0]) for pixel in np.where(data == max_value)]
+        if (np.min(max_pixel) > window_size and max_pixel[0] < data.shape[0] - window_size and
+                max_pixel[1] < data.shape[1] - window_size):
+            data[max_pixel[0] - window_size:max_pixel[0] + window_size + 1,
+                 max_pixel[1] - window_size:max_pixel[1] + window_size + 1] = 0
+            peaks.append(max_pixel)
+            if len(peaks) > 16:
+                break
+        else:
+            data[max_pixel[0], max_pixel[1]] = np.mean(data)
+    return np.array(peaks).reshape(-1, 2)
+
+
+def legacy_fit(image, peaks, window_size=20):
+    """ AlignmentView.fit_peaks before fit_spots """
+    from scipy.ndimage import center_of_mass
+    positions = []
+    for peak in peaks:
+        data = np.copy(image)
+        peak_data = data[peak[0] - window_size:peak[0] + window_size + 1,
+                         peak[1] - window_size:peak[1] + window_size + 1]
+        peak_data[peak_data < np.mean(peak_data)*1.5] = 0
+        x, y = center_of_mass(peak_data)
+        positions.append([peak[0] + x - (window_size - 0.5), peak[1] + y - (window_size - 0.5)])
+    return np.array(positions).reshape(-1, 2)
+
+
+def spot_grid(size: int, spacing: int, sigma: float, noise: float, seed: int = 0):
+    """ Gaussian spots on a grid with a little jitter, Poisson noise on an offset """
+    rng = np.random.default_rng(seed)
+    centers = np.array([(row, column) for row in range(spacing, size - spacing + 1, spacing)
+                        for column in range(spacing, size - spacing + 1, spacing)], dtype=float)
+    centers += rng.uniform(-2, 2, centers.shape)
+    rows, columns = np.mgrid[:size, :size]
+    image = np.full((size, size), 100.)
+    for amplitude, (row, column) in zip(rng.uniform(500, 1000, len(centers)), centers):
+        image += amplitude*np.exp(-((rows - row)**2 + (columns - column)**2)/(2*sigma**2))
+    image = rng.poisson(image) + rng.normal(0, noise, image.shape)
+    return np.clip(image, 0, 65535).astype(np.uint16), centers
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=140)
+    parser.add_argument('--spacing', type=int, default=25)
+    parser.add_argument('--sigma', type=float, default=2.)
+    parser.add_argument('--noise', type=float, default=20.)
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    image, centers = spot_grid(args.size, args.spacing, args.sigma, args.noise)
+    results = {}
+    for name, detect in [('legacy', legacy), ('find_peaks', find_peaks)]:
+        t0 = time.perf_counter()
+        for _ in range(args.repeats):
+            results[name] = detect(image)
+        duration = (time.perf_counter() - t0)/args.repeats
+        print(f'{name:12} {len(results[name]):3d} peaks {duration*1e3:9.2f} ms')
+    same = {tuple(peak) for peak in results['legacy']} == {tuple(peak) for peak in
+                                                          results['find_peaks']}
+    print('Same peaks:', same)
+
+    peaks = results['find_peaks']
+    for name, fit in [('legacy fit', lambda: legacy_fit(image, peaks)),
+                      ('fit_spots', lambda: fit_spots(image, peaks)),
+                      ('+ gaussian', lambda: fit_spots(image, peaks, gaussian=True))]:
+        t0 = time.perf_counter()
+        for _ in range(args.repeats):
+            fit()
+        duration = (time.perf_counter() - t0)/args.repeats
+        print(f'{name:12} {duration*1e3:9.2f} ms')
+    fits = fit_spots(image, peaks, gaussian=True)
+    legacy_positions = legacy_fit(image, peaks)
+    print('Max difference to the legacy centroids:',
+          np.abs(legacy_positions - np.stack([fits.row, fits.column], axis=1)).max())
+    print('Quality:', alignment_quality(fits))
+
+
+if __name__ == '__main__':
+    main()
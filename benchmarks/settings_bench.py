@@ -0,0 +1,62 @@
+""" Time building MMSettings from the Java sequence settings on the stand-in bridge, for the
+original per-element calls, the reduced per-element calls and the json payload.
+
+    python -m benchmarks.settings_bench --slices 300 --channels 4 --latency 0.0005
+"""
+
+import argparse
+import time
+
+from data_structures import MMSettings
+from fake_bridge import DEFAULT_SETTINGS, FakeBridge, FakeSequenceSettings
+
+
+def legacy(java_settings):
+    """ The calls MMSettings.__post_init__ made before the payload was added """
+    java_settings.interval_ms()
+    java_settings.num_frames()
+    java_channels = java_settings.channels()
+    java_settings.acq_order_mode()
+    java_settings.use_channels()
+    java_settings.channel_group()
+    java_settings.acq_order_mode()
+    java_channels.size()
+    for channel_ind in range(java_channels.size()):
+        channel = java_channels.get(channel_ind)
+        channel.config()
+        channel.use_channel()
+        channel.exposure()
+        channel.do_z_stack()
+    java_settings.use_slices()
+    java_slices = java_settings.slices()
+    slices = []
+    for slice_num in range(java_settings.slices().size()):
+        slices.append(java_slices.get(slice_num))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--slices', type=int, default=300)
+    parser.add_argument('--channels', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0.0005)
+    args = parser.parse_args()
+
+    bridge = FakeBridge(latency=args.latency)
+    settings = dict(DEFAULT_SETTINGS)
+    settings['slices'] = [float(z) for z in range(args.slices)]
+    settings['channels'] = [{'config': str(n), 'use_channel': True, 'exposure': 100.,
+                             'do_z_stack': True} for n in range(args.channels)]
+    java_settings = FakeSequenceSettings(bridge, settings)
+
+    for name, build in [('legacy', legacy),
+                        ('per element', lambda java: MMSettings(java)),
+                        ('payload', lambda java: MMSettings(java, bridge=bridge))]:
+        calls = bridge.calls
+        t0 = time.perf_counter()
+        build(java_settings)
+        duration = time.perf_counter() - t0
+        print(f'{name:12} {bridge.calls - calls:5d} calls {duration*1e3:9.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
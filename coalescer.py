@@ -0,0 +1,84 @@
+import threading
+import time
+from typing import Callable, Hashable
+
+
+class Coalescer:
+    """ Holds the latest value per key and hands it on at most max_rate times per second.
+    The first value after a quiet period is emitted right away, values that arrive faster are
+    collapsed into one that is flushed when the interval is over. Like this the receiving slots
+    are never flooded, but always end up with the final state (e.g. the resting stage position)."""
+
+    def __init__(self, max_rate: float = 20):
+        self.interval = 1/max_rate
+        self._pending = {}
+        self._last_emit = {}
+        self._lock = threading.Condition()
+        self._stop = False
+        self.received = 0
+        self.emitted = 0
+
+        self._thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self._thread.start()
+
+    def push(self, key: Hashable, emit: Callable, *args, defer: bool = False):
+        """ Offer a new value for key. emit(*args) is called now if the key was quiet for longer
+        than the interval, otherwise the value replaces the pending one for the trailing flush.
+        With defer the value always waits for the trailing flush."""
+        now = time.perf_counter()
+        with self._lock:
+            self.received += 1
+            quiet = now - self._last_emit.get(key, 0) >= self.interval
+            if quiet and not defer and key not in self._pending:
+                self._last_emit[key] = now
+                self.emitted += 1
+            else:
+                self._pending[key] = (emit, args)
+                self._lock.notify()
+                return
+        emit(*args)
+
+    def _due(self, now):
+        return [key for key in self._pending if now - self._last_emit.get(key, 0) >= self.interval]
+
+    def _flush_loop(self):
+        while True:
+            with self._lock:
+                while not self._stop:
+                    now = time.perf_counter()
+                    due = self._due(now)
+                    if due:
+                        break
+                    timeout = None
+                    if self._pending:
+                        next_emit = min(self._last_emit.get(key, 0) for key in self._pending)
+                        timeout = next_emit + self.interval - now
+                    self._lock.wait(timeout)
+                if self._stop:
+                    return
+                to_emit = []
+                for key in due:
+                    to_emit.append(self._pending.pop(key))
+                    self._last_emit[key] = now
+                self.emitted += len(to_emit)
+            for emit, args in to_emit:
+                emit(*args)
+
+    def flush(self):
+        """ Emit everything that is pending right now """
+        with self._lock:
+            to_emit = list(self._pending.values())
+            now = time.perf_counter()
+            for key in self._pending:
+                self._last_emit[key] = now
+            self._pending = {}
+            self.emitted += len(to_emit)
+        for emit, args in to_emit:
+            emit(*args)
+
+    def stop(self):
+        self.flush()
+        with self._lock:
+            self._stop = True
+            self._lock.notify()
+        self._thread.join()
@@ -1,7 +1,17 @@
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, replace
 import numpy as np
-from typing import List, Any
+from typing import List, Any, NamedTuple, Tuple
 from pathlib import Path
+import json
+import threading
+import weakref
+from enum import IntEnum
+
+import zmq
+
+from logger import get_logger
+
+log = get_logger("events")
 
 
 @dataclass
@@ -11,6 +21,16 @@ class PyImage:
     channel: int
     z_slice: int
     time: int
+    # Pixels of the regions registered on the EventListener by name, raw_image is None if only
+    # these were fetched
+    rois: dict = field(default_factory=dict)
+
+    def roi(self, name: str, rect: Tuple[int, int, int, int]) -> np.ndarray:
+        """ Pixels of a registered region, or cut from the full frame if it was not fetched """
+        if name in self.rois:
+            return self.rois[name]
+        x, y, width, height = rect
+        return self.raw_image[y:y + height, x:x + width]
 
 
 @dataclass
@@ -20,9 +40,32 @@ class MMChannel:
     power: float
     exposure_ms: int
 
+SEQUENCE_SETTINGS = "org.micromanager.acquisition.SequenceSettings"
+# Settings can be built on several threads, each gets its own socket for the static class
+_local = threading.local()
+
+
+def _close_socket(java_object):
+    socket = getattr(java_object, '_socket', None)
+    if socket is not None:
+        socket.close()
+
+
+class _SettingsClass:
+    """ The static SequenceSettings class on its own socket for one thread. The socket is closed
+    when this is dropped, at the latest when the thread ends and its thread local data goes."""
+
+    def __init__(self, bridge):
+        self.bridge = bridge
+        self.java_class = bridge._get_java_class(SEQUENCE_SETTINGS, new_socket=True)
+        weakref.finalize(self, _close_socket, self.java_class)
+
+
 @dataclass
 class MMSettings:
     java_settings: Any = None
+    # If the bridge is given, the settings are fetched in one round trip as json
+    bridge: Any = None
 
     timepoints: int =  11
     interval_ms: int = 1000
@@ -53,25 +96,80 @@ class MMSettings:
 
 
     def __post_init__(self):
+        if self.java_settings is None:
+            return
 
-        if self.java_settings is not None:
-            # print(dir(self.java_settings))
-            self.interval_ms = self.java_settings.interval_ms()
-            self.timepoints = self.java_settings.num_frames()
-            self.java_channels = self.java_settings.channels()
-            self.acq_order = self.java_settings.acq_order_mode()
-            self.use_channels = self.java_settings.use_channels()
-            self.channel_group = self.java_settings.channel_group()
-            if all([self.channel_group.lower() == "emission filter",
-                    self.use_channels]):
-                self.post_delay = 0.5
-            self.acq_order_mode= self.java_settings.acq_order_mode()
+        payload = self.fetch_payload()
+        try:
+            self.from_payload(payload)
+        except (TypeError, KeyError):
+            # No payload or one with fields we don't know
+            self.from_java()
 
+        if all([self.channel_group.lower() == "emission filter",
+                self.use_channels]):
+            self.post_delay = 0.5
+        if len(self.slices) == 0:
+            self.slices = [0]
 
+    def fetch_payload(self):
+        """ Get all the sequence settings serialized as json in one call to the bridge. Returns
+        None if that is not possible, e.g. no bridge was given or the Micro-Manager version does
+        not support it."""
+        if self.bridge is None or getattr(_local, "unsupported", False):
+            return None
         try:
-            self.java_channels.size()
-        except:
-            return
+            settings_class = getattr(_local, "settings_class", None)
+            if settings_class is None or settings_class.bridge is not self.bridge:
+                settings_class = _local.settings_class = _SettingsClass(self.bridge)
+            payload = json.loads(settings_class.java_class.to_json_stream(self.java_settings))
+        except (zmq.ZMQError, TimeoutError) as error:
+            # The connection had a problem, try again on a new socket next time
+            log.warning("Could not fetch the settings as json: %r", error)
+            _local.settings_class = None
+            return None
+        except Exception as error:
+            # This Micro-Manager version can't do it, don't try again for every new setting
+            log.info("Settings are fetched field by field: %r", error)
+            _local.unsupported = True
+            return None
+        # Depending on the Micro-Manager version the fields end with an underscore
+        return _strip_underscores(payload)
+
+    def from_payload(self, payload: dict):
+        self.interval_ms = payload["intervalMs"]
+        self.timepoints = payload["numFrames"]
+        self.acq_order_mode = payload["acqOrderMode"]
+        self.acq_order = self.acq_order_mode
+        self.use_channels = payload["useChannels"]
+        self.channel_group = payload["channelGroup"]
+        self.prefix = payload.get("prefix")
+        self.save_path = Path(payload["root"]) if payload.get("root") else None
+
+        self.channels = {}
+        self.n_channels = 0
+        for channel in payload["channels"]:
+            config = channel["config"]
+            self.channels[config] = {'name': config,
+                                     'use': channel["useChannel"],
+                                     'exposure': channel["exposure"],
+                                     'z_stack': channel["doZStack"],
+                                     }
+            if self.channels[config]['use']:
+                self.n_channels += 1
+
+        self.use_slices = payload["useSlices"]
+        self.slices = list(payload["slices"])
+
+    def from_java(self):
+        """ Get the settings one call at a time, sizes and lists are only requested once """
+        self.interval_ms = self.java_settings.interval_ms()
+        self.timepoints = self.java_settings.num_frames()
+        self.java_channels = self.java_settings.channels()
+        self.acq_order_mode = self.java_settings.acq_order_mode()
+        self.acq_order = self.acq_order_mode
+        self.use_channels = self.java_settings.use_channels()
+        self.channel_group = self.java_settings.channel_group()
 
         self.channels = {}
         self.n_channels = 0
@@ -88,8 +186,149 @@ class MMSettings:
 
         self.use_slices = self.java_settings.use_slices()
         self.java_slices = self.java_settings.slices()
-        self.slices = []
-        for slice_num in range(self.java_settings.slices().size()):
-            self.slices.append(self.java_slices.get(slice_num))
-        if len(self.slices) == 0:
-            self.slices = [0]
\ No newline at end of file
+        self.slices = [self.java_slices.get(slice_num)
+                       for slice_num in range(self.java_slices.size())]
+
+    def snapshot(self) -> 'SettingsSnapshot':
+        return SettingsSnapshot.from_settings(self)
+
+
+class ChannelSnapshot(NamedTuple):
+    name: str
+    use: bool
+    exposure: float
+    z_stack: bool
+
+
+@dataclass(frozen=True, eq=True)
+class SettingsSnapshot:
+    """ Immutable copy of the MMSettings without the Java objects. It is shared between the
+    listener thread, the NI callbacks and the GUI without locks or copies, derived settings are
+    made with replace. Equal settings have the same hash, so it can also be used as a cache key."""
+    __slots__ = ['timepoints', 'interval_ms', 'pre_delay', 'post_delay', 'acq_order_mode',
+                 'channel_group', 'use_channels', 'channels', 'slices', 'use_slices', 'save_path',
+                 'prefix', 'sweeps_per_frame']
+
+    timepoints: int
+    interval_ms: int
+    pre_delay: float
+    post_delay: float
+    acq_order_mode: int
+    channel_group: str
+    use_channels: bool
+    channels: Tuple[ChannelSnapshot, ...]
+    slices: Tuple[float, ...]
+    use_slices: bool
+    save_path: Path
+    prefix: str
+    sweeps_per_frame: int
+
+    @classmethod
+    def from_settings(cls, settings: MMSettings) -> 'SettingsSnapshot':
+        channels = tuple(ChannelSnapshot(channel['name'], channel['use'], channel['exposure'],
+                                         channel['z_stack'])
+                         for channel in (settings.channels or {}).values())
+        return cls(timepoints=settings.timepoints,
+                   interval_ms=settings.interval_ms,
+                   pre_delay=settings.pre_delay,
+                   post_delay=settings.post_delay,
+                   acq_order_mode=settings.acq_order_mode,
+                   channel_group=settings.channel_group,
+                   use_channels=settings.use_channels,
+                   channels=channels,
+                   slices=tuple(settings.slices or ()),
+                   use_slices=settings.use_slices,
+                   save_path=settings.save_path,
+                   prefix=settings.prefix,
+                   sweeps_per_frame=settings.sweeps_per_frame)
+
+    @property
+    def n_channels(self) -> int:
+        return sum(channel.use for channel in self.channels)
+
+    def channel(self, name: str) -> ChannelSnapshot:
+        for channel in self.channels:
+            if channel.name == name:
+                return channel
+        raise KeyError(name)
+
+    def replace(self, **changes) -> 'SettingsSnapshot':
+        return replace(self, **changes)
+
+    def with_channel(self, name: str, **changes) -> 'SettingsSnapshot':
+        """ Copy with changed values for one channel, e.g. with_channel('488', exposure=50) """
+        self.channel(name)
+        channels = tuple(channel._replace(**changes) if channel.name == name else channel
+                         for channel in self.channels)
+        return self.replace(channels=channels)
+
+
+def _strip_underscores(payload):
+    if isinstance(payload, dict):
+        return {key.rstrip("_"): _strip_underscores(value) for key, value in payload.items()}
+    if isinstance(payload, list):
+        return [_strip_underscores(value) for value in payload]
+    return payload
+
+
+class Impact(IntEnum):
+    """ How much of the DAQ data has to be rebuilt for a change of the settings """
+    NONE = 0  # No effect on the waveforms, e.g. the save path
+    INTERVAL = 1  # Same timepoint, only the interval or the number of timepoints changed
+    CHANNELS = 2  # Acquisition timepoint has to be rebuilt, timing and live mode stay the same
+    FULL = 3  # The timing changed, everything has to be rebuilt
+
+
+# The channel that sets the cycle time of the DAQ, see NIDAQ.update_settings
+TIMING_CHANNEL = '488'
+
+INTERVAL_FIELDS = ['interval_ms', 'timepoints']
+CHANNEL_FIELDS = ['use_channels', 'acq_order_mode', 'post_delay', 'slices', 'use_slices']
+FULL_FIELDS = ['sweeps_per_frame', 'pre_delay']
+
+
+@dataclass
+class SettingsDiff:
+    impact: Impact
+    changed: List[str] = field(default_factory=list)
+    channels: List[str] = field(default_factory=list)
+
+
+def diff_settings(old: SettingsSnapshot, new: SettingsSnapshot) -> SettingsDiff:
+    """ Compare two settings and classify the change by the work it causes for the DAQ """
+    if old is None:
+        return SettingsDiff(Impact.FULL, ['all'])
+    if old == new:
+        return SettingsDiff(Impact.NONE)
+    diff = SettingsDiff(Impact.NONE)
+    for fields, impact in [(INTERVAL_FIELDS, Impact.INTERVAL),
+                           (CHANNEL_FIELDS, Impact.CHANNELS),
+                           (FULL_FIELDS, Impact.FULL)]:
+        for name in fields:
+            if getattr(old, name) != getattr(new, name):
+                diff.changed.append(name)
+                diff.impact = max(diff.impact, impact)
+
+    old_channels = {channel.name: channel for channel in old.channels}
+    new_channels = {channel.name: channel for channel in new.channels}
+    if list(old_channels) != list(new_channels):
+        # Channels added, removed or reordered
+        diff.channels = sorted(set(old_channels) ^ set(new_channels)) or list(new_channels)
+        diff.changed.append('channels')
+        diff.impact = max(diff.impact, Impact.CHANNELS)
+    if (TIMING_CHANNEL in old_channels) != (TIMING_CHANNEL in new_channels):
+        # The timing falls back to a default without the channel, see NIDAQ.update_settings
+        diff.impact = Impact.FULL
+    for name in new_channels:
+        if name not in old_channels:
+            continue
+        if old_channels[name].use != new_channels[name].use:
+            diff.channels.append(name)
+            diff.impact = max(diff.impact, Impact.CHANNELS)
+        if (name == TIMING_CHANNEL and
+                old_channels[name].exposure != new_channels[name].exposure):
+            diff.channels.append(name)
+            diff.impact = Impact.FULL
+    if diff.channels and 'channels' not in diff.changed:
+        diff.changed.append('channels')
+    return diff
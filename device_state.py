@@ -0,0 +1,59 @@
+""" Last known state of the devices, so that property reads do not need a round trip to
+Micro-Manager and hardware that is already in place is not moved again. The state is updated from
+the CustomSettingsEvents of the listener and from the commands we send ourselves. Devices that are
+only controlled from here (flippers, LED) use their own names as keys."""
+
+import threading
+
+from logger import get_logger
+
+log = get_logger("events")
+
+
+class DeviceStateCache:
+    def __init__(self, core=None):
+        # Reads that are not cached yet go to the core, without one they return None
+        self.core = core
+        self._lock = threading.Lock()
+        self._state = {}
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+
+    def get_property(self, device: str, prop: str) -> str:
+        """ Drop-in for core.get_property """
+        key = (device, prop)
+        with self._lock:
+            if key in self._state:
+                self.hits += 1
+                return self._state[key]
+            self.misses += 1
+        value = None if self.core is None else self.core.get_property(device, prop)
+        with self._lock:
+            # An event that came in during the read is newer
+            return self._state.setdefault(key, value)
+
+    def update(self, device: str, prop: str, value) -> bool:
+        """ Record a new value. Returns False if it was known to be set already, then the command
+        that would set it can be skipped."""
+        key = (device, prop)
+        with self._lock:
+            if key in self._state and self._state[key] == value:
+                self.skipped += 1
+                return False
+            self._state[key] = value
+            return True
+
+    def invalidate(self, device: str = None):
+        """ Forget the state of one device or of all, e.g. if a command failed """
+        with self._lock:
+            if device is None:
+                self._state.clear()
+            else:
+                for key in [key for key in self._state if key[0] == device]:
+                    del self._state[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'skipped': self.skipped,
+                    'cached': len(self._state)}
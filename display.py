@@ -0,0 +1,89 @@
+""" Conversion of camera frames to 8 bit QImages for display. The display levels are estimated from
+a histogram of every subsample-th pixel, only every update_every frames, the mapping from the levels
+to 0-255 is precomputed as integer shift and multiply, so a frame is converted in a few passes of
+uint16 arithmetic into buffers that are reused and shared with the QImages. The passes run over
+blocks of CHUNK_ROWS rows, that stay in the cache from one pass to the next."""
+
+import numpy as np
+from PyQt5.QtGui import QImage
+
+# 128 rows of a 2048 pixel wide uint16 frame are 512 kB
+CHUNK_ROWS = 128
+
+
+class DisplayConverter:
+    def __init__(self, bit_depth: int = 16, update_every: int = 10, subsample: int = 8,
+                 saturated: float = 0.001):
+        self.bit_depth = bit_depth
+        self.update_every = update_every
+        self.subsample = subsample
+        # Fraction of the pixels that is allowed to be black or white on each end
+        self.saturated = saturated
+        self.levels = None
+        self.frames = 0
+        self._shape = None
+        self._buffers = []
+        self._images = []
+        self._work = None
+
+    def set_bit_depth(self, bit_depth: int):
+        if bit_depth != self.bit_depth:
+            self.bit_depth = bit_depth
+            self.levels = None
+
+    def update_levels(self, image: np.ndarray):
+        """ Levels from a histogram of a subsample of the image """
+        sample = image[::self.subsample, ::self.subsample].ravel()
+        histogram = np.cumsum(np.bincount(sample, minlength=2**self.bit_depth))
+        cut = self.saturated*histogram[-1]
+        low = int(np.searchsorted(histogram, cut, side='right'))
+        high = int(np.searchsorted(histogram, histogram[-1] - cut, side='left'))
+        self.set_levels(low, max(high, low + 1))
+
+    def set_levels(self, low: int, high: int):
+        self.levels = (low, high)
+        value_range = high - low
+        # After the shift the values are below 256, times the factor and >> 7 they span 0-255.
+        # All products stay below 2**16, so the whole conversion works in uint16.
+        self._shift = max(value_range.bit_length() - 8, 0)
+        self._factor = round(255*128/max(value_range >> self._shift, 1))
+
+    def _prepare(self, shape):
+        if shape != self._shape:
+            self._shape = shape
+            self._work = np.empty((min(CHUNK_ROWS, shape[0]),) + shape[1:], dtype=np.uint16)
+            # Two buffers, so the last image is still intact while the next one is converted
+            self._buffers = [np.empty(shape, dtype=np.uint8) for _ in range(2)]
+            self._images = [QImage(buffer.data, shape[1], shape[0], shape[1],
+                                   QImage.Format.Format_Grayscale8) for buffer in self._buffers]
+
+    def convert(self, image: np.ndarray, auto_levels: bool = True) -> QImage:
+        """ The image as 8 bit QImage. It shares memory with a buffer that is used again two
+        frames later, copy it to keep it longer, e.g. QPixmap.fromImage does. Without auto_levels
+        the levels that were set last are used."""
+        if self.bit_depth <= 8 and image.dtype == np.uint8:
+            image = np.ascontiguousarray(image)
+            qimage = QImage(image.data, image.shape[1], image.shape[0], image.strides[0],
+                            QImage.Format.Format_Grayscale8)
+            # Keep the array alive as long as the QImage
+            qimage.ndarray = image
+            return qimage
+        image = np.asarray(image, dtype=np.uint16)
+        if self.levels is None or (auto_levels and self.frames % self.update_every == 0):
+            self.update_levels(image)
+        self.frames += 1
+        self._prepare(image.shape)
+        low, high = self.levels
+        index = self.frames % 2
+        buffer = self._buffers[index]
+        for start in range(0, image.shape[0], CHUNK_ROWS):
+            rows = image[start:start + CHUNK_ROWS]
+            work = self._work[:rows.shape[0]]
+            np.clip(rows, low, high, out=work)
+            np.subtract(work, low, out=work)
+            if self._shift:
+                np.right_shift(work, self._shift, out=work)
+            np.multiply(work, self._factor, out=work)
+            # The last pass writes the 8 bit result, the values are below 256 by then
+            np.right_shift(work, 7, out=buffer[start:start + CHUNK_ROWS], casting='unsafe')
+        return self._images[index]
@@ -0,0 +1,48 @@
+""" Light dose on the sample from the schedule that is written to the DAQ. The AOTF lines are driven
+with power/10 V while the blanking line is high, so the mean of these rows over the schedule is the
+mean power. Doses are in full power seconds: one second of one laser line at 100%."""
+
+import time
+
+import numpy as np
+
+# Rows of the daq_data, see NIDAQ.init_task
+BLANK_ROW = 3
+AOTF_ROWS = {'488': 4, '561': 5}
+# Volts on the AOTF lines per fraction of the maximum power
+VOLTS_PER_POWER = 10
+
+
+def dose_rates(daq_data: np.ndarray) -> dict:
+    """ Mean power of each laser line over the schedule as a fraction of the maximum power """
+    if daq_data is None or daq_data.ndim != 2 or daq_data.shape[0] <= max(AOTF_ROWS.values()):
+        return {line: 0. for line in AOTF_ROWS}
+    on = daq_data[BLANK_ROW] > 0
+    return {line: float(np.mean(daq_data[row]*on))/VOLTS_PER_POWER
+            for line, row in AOTF_ROWS.items()}
+
+
+def dose_rate(daq_data: np.ndarray) -> float:
+    """ Total dose per second of running the schedule, in full power seconds per second """
+    return sum(dose_rates(daq_data).values())
+
+
+class DoseIntegrator:
+    """ Integrates a piecewise constant dose rate. take() is called when the position changes and
+    returns the dose that was collected at the old position, so there is no need to poll."""
+
+    def __init__(self):
+        self.rate = 0.
+        self._since = time.perf_counter()
+
+    def take(self) -> float:
+        now = time.perf_counter()
+        dose = self.rate*(now - self._since)
+        self._since = now
+        return dose
+
+    def set_rate(self, rate: float) -> float:
+        """ Change the rate, returns the dose collected with the old one """
+        dose = self.take()
+        self.rate = rate
+        return dose
@@ -0,0 +1,121 @@
+import json
+import threading
+import time
+from collections import defaultdict, deque
+
+import numpy as np
+
+# Points in the life of an event, times are measured from when the message was received
+STAGES = ['decode', 'proxy', 'emit', 'slot']
+
+
+class EventTrace:
+    """ Time stamps of one event on its way from Micro-Manager to the slots """
+    __slots__ = ['event_type', 'received', 'emitted', 'stamps']
+
+    def __init__(self, event_type: str, received: float, emitted: float = None):
+        self.event_type = event_type
+        self.received = received
+        # Wall clock time the event was sent by the server, if the message has it
+        self.emitted = emitted
+        self.stamps = {}
+
+    def stamp(self, stage: str):
+        self.stamps[stage] = time.perf_counter()
+
+
+class EventMetrics:
+    """ Collects the latencies of the events per event type. The last max_samples latencies of
+    each stage are kept to get percentiles, summary() can be called at any time while running."""
+
+    def __init__(self, max_samples: int = 5000):
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        self._latencies = defaultdict(lambda: deque(maxlen=self.max_samples))
+        self._counts = defaultdict(int)
+        self._first = {}
+        self._last = {}
+        # Traces emitted on each signal that a slot was not called for yet, one FIFO per slot.
+        # Queued slots are called in the order of the emits, so the oldest trace is the one the
+        # slot is handling.
+        self._pending = defaultdict(dict)
+        self.start = time.perf_counter()
+
+    def received(self, trace: EventTrace):
+        with self._lock:
+            self._counts[trace.event_type] += 1
+            self._first.setdefault(trace.event_type, trace.received)
+            self._last[trace.event_type] = trace.received
+            if trace.emitted is not None:
+                self._latencies[(trace.event_type, 'transport')].append(
+                    time.time() - (time.perf_counter() - trace.received) - trace.emitted)
+
+    def record(self, trace: EventTrace, stage: str):
+        trace.stamp(stage)
+        with self._lock:
+            self._latencies[(trace.event_type, stage)].append(
+                trace.stamps[stage] - trace.received)
+
+    def emitted(self, signal: str, trace: EventTrace):
+        self.record(trace, 'emit')
+        with self._lock:
+            for pending in self._pending[signal].values():
+                pending.append(trace)
+
+    def slot_entry(self, signal: str, slot: str = None):
+        """ Call at the start of a slot connected to signal of the listener. Several slots of one
+        signal need different names. The first call only registers the slot, the traces are
+        matched from then on."""
+        with self._lock:
+            slots = self._pending[signal]
+            if slot not in slots:
+                slots[slot] = deque(maxlen=self.max_samples)
+                return
+            trace = slots[slot].popleft() if slots[slot] else None
+        if trace is not None:
+            self.record(trace, 'slot')
+
+    def drop_pending(self, signal: str, slot: str = None):
+        """ Forget the traces queued for a slot that was disconnected, it was not called for them """
+        with self._lock:
+            if slot in self._pending[signal]:
+                self._pending[signal][slot].clear()
+
+    def summary(self):
+        """ Per event type: count, throughput in events/s and p50/p99 latencies in ms """
+        with self._lock:
+            latencies = {key: np.asarray(values) for key, values in self._latencies.items()}
+            counts = dict(self._counts)
+            first, last = dict(self._first), dict(self._last)
+        summary = {}
+        for event_type, count in counts.items():
+            duration = last[event_type] - first[event_type]
+            entry = {'count': count,
+                     'rate': (count - 1)/duration if duration > 0 else 0.}
+            for stage in ['transport'] + STAGES:
+                values = latencies.get((event_type, stage))
+                if values is not None and values.size:
+                    p50, p99 = np.percentile(values, [50, 99])*1000
+                    entry[stage] = {'p50_ms': p50, 'p99_ms': p99}
+            summary[event_type] = entry
+        return summary
+
+    def report(self):
+        lines = [f"{'event':36} {'count':>7} {'1/s':>7}" +
+                 ''.join(f" {stage + ' p50/p99 ms':>22}" for stage in ['transport'] + STAGES)]
+        for event_type, entry in sorted(self.summary().items()):
+            line = f"{event_type:36} {entry['count']:7d} {entry['rate']:7.1f}"
+            for stage in ['transport'] + STAGES:
+                if stage in entry:
+                    line += f" {entry[stage]['p50_ms']:10.2f}/{entry[stage]['p99_ms']:<11.2f}"
+                else:
+                    line += f" {'-':>22}"
+            lines.append(line)
+        return '\n'.join(lines)
+
+    def dump(self, path=None):
+        """ Print the report and optionally write the summary as json """
+        print(self.report())
+        if path is not None:
+            with open(path, 'w') as file:
+                json.dump(self.summary(), file, indent=2)
@@ -0,0 +1,143 @@
+""" Record the raw event stream of the PythonEventServer plugin to a file and publish it again
+later. With this the EventListener can be benchmarked and tested without Micro-Manager running:
+
+    python event_recorder.py record events.mmev
+    python event_recorder.py replay events.mmev --port 5557 --speed 0
+
+File format: gzip stream starting with MAGIC, followed by one record per message consisting of
+the time since the start of the recording (float64), the number of frames (uint16) and for each
+frame its length (uint32) and the raw bytes."""
+
+import argparse
+import gzip
+import struct
+import time
+
+import zmq
+
+MAGIC = b'MMEV1\n'
+SOCKET = '5556'
+TOPICS = ["StandardEvent", "GUIRefreshEvent", "ImageEvent"]
+
+_RECORD = struct.Struct('<dH')
+_FRAME = struct.Struct('<I')
+
+
+class EventRecorder:
+    """ Subscribes to the event server and writes every message with its receive time """
+
+    def __init__(self, path, address: str = "tcp://localhost:" + SOCKET, topics=TOPICS):
+        self.path = path
+        self.context = zmq.Context.instance()
+        self.socket = self.context.socket(zmq.SUB)
+        self.socket.connect(address)
+        self.socket.setsockopt(zmq.RCVTIMEO, 200)
+        for topic in topics:
+            self.socket.setsockopt_string(zmq.SUBSCRIBE, topic)
+        self.n_messages = 0
+        self.n_bytes = 0
+
+    def record(self, duration: float = None, max_messages: int = None):
+        """ Record until duration or max_messages is reached or Ctrl+C is pressed """
+        with gzip.open(self.path, 'wb', compresslevel=3) as file:
+            file.write(MAGIC)
+            t0 = time.perf_counter()
+            try:
+                while duration is None or time.perf_counter() - t0 < duration:
+                    try:
+                        frames = self.socket.recv_multipart()
+                    except zmq.error.Again:
+                        continue
+                    file.write(_RECORD.pack(time.perf_counter() - t0, len(frames)))
+                    for frame in frames:
+                        file.write(_FRAME.pack(len(frame)))
+                        file.write(frame)
+                        self.n_bytes += len(frame)
+                    self.n_messages += 1
+                    if max_messages is not None and self.n_messages >= max_messages:
+                        break
+            except KeyboardInterrupt:
+                pass
+        self.socket.close()
+        return self.n_messages
+
+
+def read_events(path):
+    """ Generator of (time, frames) tuples from a recorded file """
+    with gzip.open(path, 'rb') as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{path} is not an event recording')
+        while True:
+            header = file.read(_RECORD.size)
+            if len(header) < _RECORD.size:
+                return
+            timestamp, n_frames = _RECORD.unpack(header)
+            frames = []
+            for _ in range(n_frames):
+                length, = _FRAME.unpack(file.read(_FRAME.size))
+                frames.append(file.read(length))
+            yield timestamp, frames
+
+
+class EventReplayer:
+    """ Publishes a recording on a local PUB socket. speed scales the original timing, 2 plays
+    twice as fast, 0 sends as fast as possible."""
+
+    def __init__(self, path, port: str = SOCKET, warmup: float = 0.5):
+        self.path = path
+        self.context = zmq.Context.instance()
+        self.socket = self.context.socket(zmq.PUB)
+        self.socket.setsockopt(zmq.SNDHWM, 0)
+        self.socket.bind("tcp://*:" + str(port))
+        # Give subscribers time to connect, PUB drops everything sent before that
+        time.sleep(warmup)
+
+    def replay(self, speed: float = 1., loops: int = 1):
+        """ Returns the number of messages sent and the time it took """
+        n_messages = 0
+        t0 = time.perf_counter()
+        for _ in range(loops):
+            loop_start = time.perf_counter()
+            for timestamp, frames in read_events(self.path):
+                if speed > 0:
+                    wait = loop_start + timestamp/speed - time.perf_counter()
+                    if wait > 0:
+                        time.sleep(wait)
+                self.socket.send_multipart(frames)
+                n_messages += 1
+        return n_messages, time.perf_counter() - t0
+
+    def close(self):
+        self.socket.close(linger=1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    record = commands.add_parser('record', help='Record events from Micro-Manager')
+    record.add_argument('path')
+    record.add_argument('--address', default="tcp://localhost:" + SOCKET)
+    record.add_argument('--duration', type=float, default=None)
+    replay = commands.add_parser('replay', help='Publish a recording on a local socket')
+    replay.add_argument('path')
+    replay.add_argument('--port', default=SOCKET)
+    replay.add_argument('--speed', type=float, default=1.,
+                        help='Factor on the original timing, 0 for maximum speed')
+    replay.add_argument('--loops', type=int, default=1)
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        recorder = EventRecorder(args.path, args.address)
+        print('Recording, stop with Ctrl+C')
+        n_messages = recorder.record(args.duration)
+        print(f'Recorded {n_messages} messages, {recorder.n_bytes/1e6:.1f} MB')
+    else:
+        replayer = EventReplayer(args.path, args.port)
+        n_messages, duration = replayer.replay(args.speed, args.loops)
+        replayer.close()
+        print(f'Sent {n_messages} messages in {duration:.2f} s '
+              f'({n_messages/max(duration, 1e-9):.0f} messages/s)')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,175 +1,319 @@
 from xmlrpc.client import boolean
 from pycromanager import Bridge
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import threading
-import re
 import zmq
+import zmq.asyncio
 import json
 from PyQt5.QtCore import QObject, pyqtSignal, QThread, pyqtSlot
 import time
+import numpy as np
 
 from data_structures import PyImage, MMSettings
+from socket_pool import SocketPool
+from coalescer import Coalescer
+from event_metrics import EventMetrics, EventTrace
+from device_state import DeviceStateCache
+from logger import get_logger
 
 SOCKET = "5556"
+# Seconds that closing waits for the listener thread
+STOP_TIMEOUT = 2
+log = get_logger("events")
 
 
 class EventThread(QObject):
     """Thread that receives events from Micro-Manager and relays them to the main program"""
 
-    def __init__(self):
+    def __init__(self, address: str = "tcp://localhost:" + SOCKET, bridge: Bridge = None,
+                 use_asyncio: bool = True):
         super().__init__()
 
-        self.bridge = Bridge(debug=False)
+        # A stand-in bridge can be passed for offline tests, see fake_bridge.py
+        self.bridge = Bridge(debug=False) if bridge is None else bridge
 
-        # Make sockets that events circle through to always have a ready socket
-        self.event_sockets = []
-        self.num_sockets = 5
-        for socket in range(self.num_sockets):
-            socket_provider = self.bridge._construct_java_object(
-                "org.micromanager.Studio", new_socket=True
-            )
-            self.event_sockets.append(socket_provider._socket)
+        # Pool of sockets that the event proxies are checked out on, so that we always have an
+        # idle socket, even when several events need Java calls at the same time.
+        self.socket_pool = SocketPool(self.bridge, min_size=5, max_size=20)
+
+        self.thread_stop = False
+        self.topics = ["StandardEvent", "GUIRefreshEvent", "ImageEvent"]
+
+        if use_asyncio:
+            # The listener lives in the main thread and runs its own asyncio loop in the background
+            self.context = None
+            self.socket = None
+            self.thread = None
+            self.listener = AsyncEventListener(address, self.topics, self.socket_pool,
+                                               self.bridge)
+            self.listener.stop_thread_event.connect(self.stop)
+            self.listener.start()
+            return
 
         # PUB/SUB
         self.context = zmq.Context()
         self.socket = self.context.socket(zmq.SUB)
-        self.socket.connect("tcp://localhost:5556")
+        # Can also point to a replayed recording, see event_recorder.py
+        self.socket.connect(address)
         self.socket.setsockopt(zmq.RCVTIMEO, 1000)  # Timeout for the recv() function
 
-        self.thread_stop = False
-
-        self.topics = ["StandardEvent", "GUIRefreshEvent", "ImageEvent"]
         for topic in self.topics:
             self.socket.setsockopt_string(zmq.SUBSCRIBE, topic)
 
         self.thread = QThread()
-        self.listener = EventListener(self.socket, self.event_sockets, self.bridge, self.thread)
+        self.listener = EventListener(self.socket, self.socket_pool, self.bridge, self.thread)
         self.listener.moveToThread(self.thread)
         self.thread.started.connect(self.listener.start)
         self.listener.stop_thread_event.connect(self.stop)
         self.thread.start()
 
     def stop(self):
+        if self.thread is not None:
+            self.thread.exit()
+            while self.thread.isRunning():
+                time.sleep(0.05)
 
-        print("Closing socket")
-        self.thread.exit()
-        while self.thread.isRunning():
-            time.sleep(0.05)
-
-        print('Closing socket')
-        self.socket.close()
-        for socket in self.event_sockets:
-            socket.close()
-        self.context.term()
+        log.info("Closing socket")
+        self.listener.coalescer.stop()
+        log.info("Socket pool: %s", self.socket_pool.stats())
+        log.info("Device state: %s", self.listener.device_state.stats())
+        log.info("Images: %s fetched, %.1f MB of pixels", self.listener.images_fetched,
+                 self.listener.image_bytes/1e6)
+        self.listener.metrics.dump()
+        if self.socket is not None:
+            self.socket.close()
+            self.context.term()
+        self.socket_pool.close()
 
 
 class EventListener(QObject):
     xy_stage_position_changed_event = pyqtSignal(tuple)
     stage_position_changed_event = pyqtSignal(float)
+    # Emitted with None, the event proxies are released before the signals are emitted
     acquisition_started_event = pyqtSignal(object)
     acquisition_ended_event = pyqtSignal(object)
+    # raw_image is None while all owners of register_rois only need their regions, slots that
+    # use the full frame have to register with full_frame=True
     new_image_event = pyqtSignal(PyImage)
     settings_event = pyqtSignal(str, str, str)
     mda_settings_event = pyqtSignal(object)
     live_mode_event = pyqtSignal(bool)
     stop_thread_event = pyqtSignal()
 
-    def __init__(self, socket, event_sockets, bridge: Bridge, thread: QThread):
+    def __init__(self, socket, socket_pool: SocketPool, bridge: Bridge, thread: QThread):
         super().__init__()
         self.loop_stop = False
         self.socket = socket
-        self.event_sockets = event_sockets
+        self.socket_pool = socket_pool
         self.bridge = bridge
         self.thread = thread
         # Record times for events that we receive twice
         self.last_acq_started = time.perf_counter()
         self.last_custom_mda = time.perf_counter()
-        self.last_stage_position = time.perf_counter()
+        # fetch runs on several threads, the check of the repeated MDA events has to be atomic
+        self._mda_lock = threading.Lock()
         self.blockZ = False
         self.blockImages = False
+        # Position and settings events are collapsed to the latest value per key, so the slots
+        # are called at most max_rate times per second but always get the final state.
+        self.coalescer = Coalescer(max_rate=20)
+        # Latencies from receiving an event to the slots, see event_metrics.py
+        self.metrics = EventMetrics()
+        # Property values as of the last settings event, see device_state.py
+        self.device_state = DeviceStateCache(bridge.get_core())
+        # Regions of the images the consumers need, see register_rois. The request is replaced
+        # as a whole, as it is read by the fetch threads.
+        self._consumers = {}
+        self._image_request = ({}, True)
+        self.images_fetched = 0
+        self.image_bytes = 0
 
     pyqtSlot()
 
     def start(self):
-        instance = 0
         while not self.loop_stop:
-            instance = instance + 1 if instance < 100 else 0
             try:
                 #  Get the reply.
-                reply = str(self.socket.recv())
-                # topic = re.split(' ', reply)[0][2:]
-                message = json.loads(re.split(" ", reply)[1][0:-1])
-                socket_num = instance % len(self.event_sockets)
-                pre_evt = self.bridge._class_factory.create(message)
-
-                evt = pre_evt(
-                    socket=self.event_sockets[socket_num],
-                    serialized_object=message,
-                    bridge=self.bridge,
-                )
-
-                eventString = message["class"].split(r".")[-1]
-                print(eventString, " ", time.perf_counter())
-                if "ExposureChangedEvent" in eventString:
-                    print(evt.get_new_exposure_time())
-                elif "DefaultAcquisitionStartedEvent" in eventString:
-                    if time.perf_counter() - self.last_acq_started > 0.2:
-                        self.acquisition_started_event.emit(evt)
-                    else:
-                        print("SKIPPED")
-                    self.last_acq_started = time.perf_counter()
-                elif "DefaultAcquisitionEndedEvent" in eventString:
-                    self.acquisition_ended_event.emit(evt)
-                elif "DefaultStagePositionChangedEvent" in eventString:
-                    if (
-                        self.blockZ > 0
-                        or time.perf_counter() - self.last_stage_position < 0.05
-                    ):
-                        print("BLOCKED ", self.blockZ)
-                    else:
-                        self.stage_position_changed_event.emit(evt.get_pos() * 100)
-                    self.last_stage_position = time.perf_counter()
-                    self.blockZ = False
-                elif "XYStagePositionChangedEvent" in eventString:
-                    self.xy_stage_position_changed_event.emit(
-                        (evt.get_x_pos(), evt.get_y_pos())
-                    )
-                elif "DefaultNewImageEvent" in eventString:
-                    if self.blockImages:
-                        return
-                    image = evt.get_image()
-                    py_image = PyImage(image.get_raw_pixels().reshape([image.get_width(),
-                                                                       image.get_height()]),
-                                       image.get_coords().get_t(),
-                                       image.get_coords().get_c(),
-                                       image.get_coords().get_z(),
-                                       image.get_metadata().get_elapsed_time_ms())
-                                    #  0) # no elapsed time
-                    self.new_image_event.emit(py_image)
-                elif "CustomSettingsEvent" in eventString:
-                    self.settings_event.emit(
-                        evt.get_device(), evt.get_property(), evt.get_value()
-                    )
-                elif "CustomMDAEvent" in eventString:
-                    if time.perf_counter() - self.last_custom_mda > 0.2:
-                        settings = evt.get_settings()
-                        # print(dir(settings))
-                        settings = MMSettings(java_settings=settings)
-                        self.mda_settings_event.emit(settings)
-                        print("post_delay ", settings.post_delay)
-                    else:
-                        print("SKIPPED")
-                    self.last_custom_mda = time.perf_counter()
-                elif "DefaultLiveModeEvent" in eventString:
-                    self.blockImages = evt.get_is_on()
-                    self.live_mode_event.emit(self.blockImages)
-                    # print("Blocking images in live: ", self.blockImages)
-
-                else:
-                    print("This event is not known yet")
+                reply = self.socket.recv()
             except zmq.error.Again:
-                pass
+                continue
+            self.dispatch(*self.fetch(reply, time.perf_counter()))
         # Thread was stopped, let's also close the socket then
 
+    def fetch(self, reply: bytes, received: float):
+        """ Decode a message and do all Java calls needed for it. The socket of the event proxy
+        stays checked out from the pool until they are done and the proxies are released, only
+        plain values are returned. This is thread safe, so several events can be fetched at the
+        same time."""
+        topic, message = reply.decode().split(" ", 1)
+        message = json.loads(message)
+        eventString = message["class"].split(r".")[-1]
+        trace = EventTrace(eventString, received, message.get("emitted"))
+        self.metrics.received(trace)
+        self.metrics.record(trace, "decode")
+        with self.socket_pool.socket() as event_socket:
+            pre_evt = self.bridge._class_factory.create(message)
+            evt = pre_evt(
+                socket=event_socket,
+                serialized_object=message,
+                bridge=self.bridge,
+            )
+            try:
+                value = self._fetch_value(eventString, evt, event_socket)
+            finally:
+                # The destructors of the proxies talk to Java on their socket, that has to happen
+                # before the socket goes back to the pool and another thread gets it
+                evt._close()
+                evt = None
+        self.metrics.record(trace, "proxy")
+        return eventString, value, trace
+
+    def _fetch_value(self, eventString: str, evt, event_socket):
+        """ The value that is relayed for an event proxy, never a proxy itself """
+        value = None
+        if "ExposureChangedEvent" in eventString:
+            value = evt.get_new_exposure_time()
+        elif "DefaultStagePositionChangedEvent" in eventString:
+            value = evt.get_pos() * 100
+        elif "XYStagePositionChangedEvent" in eventString:
+            value = (evt.get_x_pos(), evt.get_y_pos())
+        elif "DefaultNewImageEvent" in eventString:
+            if not self.blockImages:
+                image = evt.get_image()
+                try:
+                    value = self._fetch_image(image, event_socket)
+                finally:
+                    image._close()
+        elif "CustomSettingsEvent" in eventString:
+            value = (evt.get_device(), evt.get_property(), evt.get_value())
+        elif "CustomMDAEvent" in eventString:
+            # Only build the settings for the first of the events we get twice
+            with self._mda_lock:
+                first = time.perf_counter() - self.last_custom_mda > 0.2
+                self.last_custom_mda = time.perf_counter()
+            if first:
+                value = MMSettings(java_settings=evt.get_settings(),
+                                   bridge=self.bridge).snapshot()
+        elif "DefaultLiveModeEvent" in eventString:
+            value = evt.get_is_on()
+        return value
+
+    def _fetch_image(self, image, event_socket) -> PyImage:
+        rois, full_frame = self._image_request
+        crops = None if full_frame else self.fetch_rois(image, rois, event_socket)
+        if crops is None:
+            raw_image = image.get_raw_pixels().reshape([image.get_width(), image.get_height()])
+            crops = {name: raw_image[y:y + height, x:x + width]
+                     for name, (x, y, width, height) in rois.items()}
+        else:
+            raw_image = None
+        coords = image.get_coords()
+        return PyImage(raw_image,
+                       coords.get_t(),
+                       coords.get_c(),
+                       coords.get_z(),
+                       image.get_metadata().get_elapsed_time_ms(),
+                       #  0) # no elapsed time
+                       rois=crops)
+
+    def fetch_rois(self, image, rois: dict, event_socket) -> dict:
+        """ Only the pixels of the regions, cropped on the Java side by an ImageJ processor. None
+        for images that are not 8 or 16 bit gray or regions that are not inside the image, the
+        full frame is needed then."""
+        studio = self.socket_pool.provider(event_socket)
+        processor = studio.data().ij().create_processor(image)
+        crops = {}
+        try:
+            for name, (x, y, width, height) in rois.items():
+                processor.set_roi(x, y, width, height)
+                pixels = np.asarray(processor.crop().get_pixels())
+                # Byte or short processor, Java has no unsigned types
+                dtype = {1: np.uint8, 2: np.uint16}.get(pixels.dtype.itemsize)
+                if dtype is None or pixels.size != width*height:
+                    log.debug("Region %s can't be cropped from a %s image", name, pixels.dtype)
+                    return None
+                crops[name] = pixels.view(dtype).reshape(height, width)
+        finally:
+            processor._close()
+        return crops
+
+    def register_rois(self, owner, rois: dict, full_frame: bool = False):
+        """ Declare the regions of the images that owner uses, as {name: (x, y, width, height)}.
+        PyImage.rois of the new_image_event has the pixels of all registered regions. As long as
+        none of the owners asks for the full frame, only the regions are transferred and
+        PyImage.raw_image is None. Without any owners, the full frames are transferred."""
+        consumers = dict(self._consumers)
+        consumers[owner] = (dict(rois), full_frame)
+        self._set_consumers(consumers)
+
+    def unregister_rois(self, owner):
+        consumers = dict(self._consumers)
+        consumers.pop(owner, None)
+        self._set_consumers(consumers)
+
+    def _set_consumers(self, consumers: dict):
+        rois = {}
+        for owner_rois, _ in consumers.values():
+            rois.update(owner_rois)
+        full_frame = not consumers or any(full for _, full in consumers.values())
+        self._consumers = consumers
+        self._image_request = (rois, full_frame)
+        log.info("Image regions %s, full frames: %s", list(rois), full_frame)
+
+    def dispatch(self, eventString: str, value, trace: EventTrace):
+        """ Relay an event that was fetched. Has to be called in the order the events came in."""
+        log.debug("%s", eventString)
+        if "ExposureChangedEvent" in eventString:
+            log.debug("New exposure time %s", value)
+        elif "DefaultAcquisitionStartedEvent" in eventString:
+            if time.perf_counter() - self.last_acq_started > 0.2:
+                self.emit_event("acquisition_started_event", trace, None)
+            else:
+                log.debug("Skipped repeated %s", eventString)
+            self.last_acq_started = time.perf_counter()
+        elif "DefaultAcquisitionEndedEvent" in eventString:
+            self.emit_event("acquisition_ended_event", trace, None)
+        elif "DefaultStagePositionChangedEvent" in eventString:
+            # If we moved the stage ourselves, don't echo the position right away, but
+            # still deliver where the stage came to rest with the trailing flush.
+            self.coalescer.push("z", self.emit_event, "stage_position_changed_event", trace,
+                                value, defer=self.blockZ)
+            self.blockZ = False
+        elif "XYStagePositionChangedEvent" in eventString:
+            self.coalescer.push("xy", self.emit_event, "xy_stage_position_changed_event", trace,
+                                value)
+        elif "DefaultNewImageEvent" in eventString:
+            if value is not None:
+                # Counted here, dispatch runs on one thread
+                self.images_fetched += 1
+                self.image_bytes += (value.raw_image.nbytes if value.raw_image is not None else
+                                     sum(crop.nbytes for crop in value.rois.values()))
+            if value is not None and not self.blockImages:
+                self.emit_event("new_image_event", trace, value)
+        elif "CustomSettingsEvent" in eventString:
+            # Update right away, the slots might only be called with the trailing flush
+            self.device_state.update(*value)
+            self.coalescer.push(("settings", *value[:2]), self.emit_event, "settings_event",
+                                trace, *value)
+        elif "CustomMDAEvent" in eventString:
+            if value is not None:
+                self.emit_event("mda_settings_event", trace, value)
+                log.debug("post_delay %s", value.post_delay)
+            else:
+                log.debug("Skipped repeated %s", eventString)
+        elif "DefaultLiveModeEvent" in eventString:
+            self.blockImages = value
+            self.emit_event("live_mode_event", trace, self.blockImages)
+            # print("Blocking images in live: ", self.blockImages)
+        else:
+            log.info("This event is not known yet: %s", eventString)
+
+    def emit_event(self, signal: str, trace: EventTrace, *args):
+        """ Emit one of the signals above and record when it happened """
+        self.metrics.emitted(signal, trace)
+        getattr(self, signal).emit(*args)
+
     pyqtSlot()
 
     def stop(self):
@@ -179,6 +323,100 @@ class EventListener(QObject):
             time.sleep(0.05)
 
 
+class AsyncEventListener(EventListener):
+    """ Listener that awaits the messages with zmq.asyncio in a background asyncio loop. It does
+    not poll with a timeout, so stop returns right away, and the object itself stays in the main
+    thread where its slots can run. The Java calls of several events run concurrently on sockets
+    from the pool, the signals are still emitted in the order the events came in."""
+
+    def __init__(self, address: str, topics: list, socket_pool: SocketPool, bridge: Bridge,
+                 max_pending: int = 100):
+        super().__init__(None, socket_pool, bridge, None)
+        self.address = address
+        self.topics = topics
+        self.max_pending = max_pending
+        self._loop = None
+        self._main_task = None
+        self._started = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        self._started.wait()
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        try:
+            self._main_task = self._loop.create_task(self._main())
+            self._started.set()
+            self._loop.run_until_complete(self._main_task)
+        except asyncio.CancelledError:
+            pass
+        except Exception as error:
+            # E.g. the socket could not connect, without this the thread would end silently
+            log.exception("Event listener stopped: %r", error)
+        finally:
+            self._started.set()
+            self._loop.close()
+
+    async def _main(self):
+        context = zmq.asyncio.Context()
+        socket = context.socket(zmq.SUB)
+        try:
+            socket.connect(self.address)
+        except zmq.ZMQError:
+            socket.close(linger=0)
+            context.term()
+            raise
+        for topic in self.topics:
+            socket.setsockopt_string(zmq.SUBSCRIBE, topic)
+        executor = ThreadPoolExecutor(max_workers=self.socket_pool.max_size,
+                                      thread_name_prefix="event_fetch")
+        queue = asyncio.Queue(maxsize=self.max_pending)
+        tasks = [asyncio.create_task(self._receive(socket, queue, executor)),
+                 asyncio.create_task(self._relay(queue))]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            socket.close(linger=0)
+            context.term()
+            # Fetches that did not start are dropped. Running ones are not waited for, a Java
+            # call that hangs must not block closing the program, they fail when the pool is
+            # closed after the listener stopped
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _receive(self, socket, queue: asyncio.Queue, executor: ThreadPoolExecutor):
+        loop = asyncio.get_running_loop()
+        while True:
+            reply = await socket.recv()
+            await queue.put(loop.run_in_executor(executor, self.fetch, reply,
+                                                 time.perf_counter()))
+
+    async def _relay(self, queue: asyncio.Queue):
+        while True:
+            future = await queue.get()
+            try:
+                self.dispatch(*await future)
+            except Exception as error:
+                log.exception("Event could not be relayed: %r", error)
+
+    pyqtSlot()
+
+    def stop(self):
+        self.loop_stop = True
+        if self._loop is not None and not self._loop.is_closed():
+            try:
+                self._loop.call_soon_threadsafe(self._main_task.cancel)
+            except RuntimeError:
+                # The loop was closed in the meantime, the listener already stopped
+                pass
+        self._thread.join(timeout=STOP_TIMEOUT)
+        if self._thread.is_alive():
+            log.warning("Event listener did not stop within %s s", STOP_TIMEOUT)
+        self.stop_thread_event.emit()
+
 
 def main():
     thread = EventThread()
@@ -186,7 +424,7 @@ def main():
         try:
             time.sleep(0.01)
         except KeyboardInterrupt:
-            thread.stop()
+            thread.listener.stop()
             print("Stopping")
             break
 
@@ -0,0 +1,464 @@
+""" Stand-in for the pycromanager Bridge and the PythonEventServer plugin, to run the event
+pipeline without Micro-Manager. FakeBridge implements the subset of core/studio calls this project
+uses with a configurable latency per call, EventGenerator publishes synthetic events that the
+FakeBridge class factory turns into event proxies.
+
+    python fake_bridge.py --stage 50 --image 20 --headless 10
+"""
+
+import argparse
+import base64
+import json
+import threading
+import time
+
+import numpy as np
+import zmq
+
+SOCKET = '5556'
+EVENT_PACKAGE = 'org.micromanager.events.internal.'
+
+DEFAULT_PROPERTIES = {('EDA', 'Label'): 'Off',
+                      ('DPseudoChannel', 'Label'): '488',
+                      ('PrimeB_Camera', 'TriggerMode'): 'Edge Trigger',
+                      ('488_AOTF', 'Power (% of max)'): '20',
+                      ('561_AOTF', 'Power (% of max)'): '50'}
+
+DEFAULT_SETTINGS = {'interval_ms': 0,
+                    'num_frames': 10,
+                    'acq_order_mode': 0,
+                    'use_channels': True,
+                    'channel_group': 'DPseudoChannel',
+                    'channels': [{'config': '488', 'use_channel': True, 'exposure': 100.,
+                                  'do_z_stack': True},
+                                 {'config': '561', 'use_channel': True, 'exposure': 100.,
+                                  'do_z_stack': True}],
+                    'use_slices': True,
+                    'slices': [float(z) for z in range(10)],
+                    'prefix': 'fake',
+                    'root': 'C:/data'}
+
+
+class FakeProxy:
+    """ Base for all fake Java objects, every call waits for the latency of the bridge """
+
+    def __init__(self, bridge: 'FakeBridge'):
+        self._bridge = bridge
+
+    def _call(self, name: str, value=None):
+        self._bridge.calls += 1
+        latency = self._bridge.latencies.get(name, self._bridge.latency)
+        if latency > 0:
+            time.sleep(latency)
+        return value
+
+    def _close(self):
+        # Like the destructor of a pycromanager proxy, one round trip on its socket
+        return self._call('_close')
+
+
+class FakeSocket:
+    def __init__(self):
+        self._closed = False
+
+    def close(self):
+        self._closed = True
+
+
+class FakeList(FakeProxy):
+    """ java.util.List """
+
+    def __init__(self, bridge, items):
+        super().__init__(bridge)
+        self._items = items
+
+    def size(self):
+        return self._call('size', len(self._items))
+
+    def get(self, index):
+        return self._call('get', self._items[index])
+
+
+class FakeRecord(FakeProxy):
+    """ Java object with getters for each of the values given, e.g. a ChannelSpec for
+    {'config': '488'} has config() and a stage event for {'pos': 1.} has get_pos()."""
+
+    def __init__(self, bridge, values: dict):
+        super().__init__(bridge)
+        self._values = values
+
+    def __getattr__(self, name):
+        values = self.__dict__.get('_values', {})
+        key = name[4:] if name.startswith('get_') and name[4:] in values else name
+        if key not in values:
+            raise AttributeError(name)
+        return lambda *args: self._call(name, values[key])
+
+
+class FakeSequenceSettings(FakeRecord):
+    def __init__(self, bridge, settings: dict):
+        self._raw = settings
+        settings = dict(settings)
+        settings['channels'] = FakeList(bridge, [FakeRecord(bridge, channel)
+                                                 for channel in settings['channels']])
+        settings['slices'] = FakeList(bridge, settings['slices'])
+        super().__init__(bridge, settings)
+
+
+class FakeSequenceSettingsClass(FakeProxy):
+    """ Static methods of org.micromanager.acquisition.SequenceSettings """
+
+    def to_json_stream(self, settings: FakeSequenceSettings):
+        raw = settings._raw
+        payload = {'numFrames_': raw['num_frames'],
+                   'intervalMs_': raw['interval_ms'],
+                   'acqOrderMode_': raw['acq_order_mode'],
+                   'useChannels_': raw['use_channels'],
+                   'channelGroup_': raw['channel_group'],
+                   'channels_': [{'config_': channel['config'],
+                                  'useChannel_': channel['use_channel'],
+                                  'exposure_': channel['exposure'],
+                                  'doZStack_': channel['do_z_stack']}
+                                 for channel in raw['channels']],
+                   'useSlices_': raw['use_slices'],
+                   'slices_': raw['slices'],
+                   'prefix_': raw['prefix'],
+                   'root_': raw['root']}
+        return self._call('to_json_stream', json.dumps(payload))
+
+
+class FakeImage(FakeProxy):
+    _pixels = {}
+
+    def __init__(self, bridge, width, height, t=0, c=0, z=0, elapsed=0.):
+        super().__init__(bridge)
+        self._shape = (width, height)
+        self._coords = FakeRecord(bridge, {'t': t, 'c': c, 'z': z})
+        self._metadata = FakeRecord(bridge, {'elapsed_time_ms': elapsed})
+
+    def pixels(self):
+        # Share the pixels between images of the same size, we only care about the transfer
+        if self._shape not in self._pixels:
+            rng = np.random.default_rng(0)
+            self._pixels[self._shape] = rng.integers(100, 1000, self._shape[0]*self._shape[1],
+                                                     dtype=np.uint16)
+        return self._pixels[self._shape]
+
+    def get_raw_pixels(self):
+        return self._call('get_raw_pixels', self.pixels())
+
+    def get_width(self):
+        return self._call('get_width', self._shape[0])
+
+    def get_height(self):
+        return self._call('get_height', self._shape[1])
+
+    def get_coords(self):
+        return self._call('get_coords', self._coords)
+
+    def get_metadata(self):
+        return self._call('get_metadata', self._metadata)
+
+
+class FakeProcessor(FakeProxy):
+    """ ij.process.ShortProcessor of an image """
+
+    def __init__(self, bridge, pixels: np.ndarray):
+        super().__init__(bridge)
+        self._pixels = pixels
+        self._roi = np.s_[:, :]
+
+    def set_roi(self, x, y, width, height):
+        self._roi = np.s_[y:y + height, x:x + width]
+        return self._call('set_roi')
+
+    def crop(self):
+        return self._call('crop', FakeProcessor(self._bridge, self._pixels[self._roi]))
+
+    def get_pixels(self):
+        # Java shorts are signed, the bridge hands them over as they are
+        return self._call('get_pixels', self._pixels.ravel().view(np.int16))
+
+
+class FakeImageJConverter(FakeProxy):
+    """ org.micromanager.data.ImageJConverter """
+
+    def create_processor(self, image: FakeImage):
+        pixels = image.pixels().reshape(image._shape)
+        return self._call('create_processor', FakeProcessor(self._bridge, pixels))
+
+
+class FakeEvent(FakeRecord):
+    """ Event proxy built from the fields of a synthetic event message """
+
+    def __init__(self, bridge, fields: dict):
+        super().__init__(bridge, fields)
+
+    def get_image(self):
+        return self._call('get_image', FakeImage(self._bridge, **self._values['image']))
+
+    def get_settings(self):
+        return self._call('get_settings',
+                          FakeSequenceSettings(self._bridge, self._values['settings']))
+
+
+class FakeClassFactory:
+    def __init__(self, bridge):
+        self.bridge = bridge
+
+    def create(self, message: dict):
+        fields = json.loads(base64.b64decode(message['fields']))
+
+        def event(socket=None, serialized_object=None, bridge=None):
+            return FakeEvent(self.bridge, fields)
+        return event
+
+
+class FakeCore(FakeProxy):
+    """ mmcorej.CMMCore, all cores of a bridge move the same stage """
+
+    @property
+    def z(self):
+        return self._bridge.stage['z']
+
+    @z.setter
+    def z(self, z):
+        self._bridge.stage['z'] = z
+
+    @property
+    def xy(self):
+        return self._bridge.stage['xy']
+
+    @xy.setter
+    def xy(self, xy):
+        self._bridge.stage['xy'] = xy
+
+    def get_position(self, *args):
+        return self._call('get_position', self.z)
+
+    def set_position(self, *args):
+        self.z = args[-1]
+        return self._call('set_position')
+
+    def set_relative_position(self, *args):
+        self.z += args[-1]
+        return self._call('set_relative_position')
+
+    def set_xy_position(self, *args):
+        self.xy = tuple(args[-2:])
+        return self._call('set_xy_position')
+
+    def get_property(self, device, prop):
+        return self._call('get_property', self._bridge.properties[(device, prop)])
+
+    def set_property(self, device, prop, value):
+        self._bridge.properties[(device, prop)] = str(value)
+        return self._call('set_property')
+
+    def get_image_bit_depth(self):
+        return self._call('get_image_bit_depth', 16)
+
+
+class FakeStudio(FakeProxy):
+    """ org.micromanager.Studio """
+
+    def __init__(self, bridge):
+        super().__init__(bridge)
+        self._data = FakeRecord(bridge, {'ij': FakeImageJConverter(bridge)})
+        self._live = FakeRecord(bridge, {'set_live_mode_on': None, 'is_live_mode_on': False})
+        self._acquisitions = FakeRecord(bridge, {})
+        self._acquisitions.get_acquisition_settings = self._acquisition_settings
+
+    def _acquisition_settings(self):
+        return self._call('get_acquisition_settings',
+                          FakeSequenceSettings(self._bridge, self._bridge.settings))
+
+    def data(self):
+        return self._call('data', self._data)
+
+    def get_snap_live_manager(self):
+        return self._call('get_snap_live_manager', self._live)
+
+    def acquisitions(self):
+        return self._call('acquisitions', self._acquisitions)
+
+
+class FakeBridge:
+    """ Replaces pycromanager.Bridge. latency is the time every Java call takes, latencies can
+    overwrite it for single methods, e.g. {'get_raw_pixels': 0.03}."""
+
+    def __init__(self, latency: float = 0.001, latencies: dict = None):
+        self.latency = latency
+        self.latencies = latencies or {}
+        self.properties = dict(DEFAULT_PROPERTIES)
+        self.settings = dict(DEFAULT_SETTINGS)
+        self.calls = 0
+        self.stage = {'z': 100., 'xy': (0., 0.)}
+        self._class_factory = FakeClassFactory(self)
+        self._core = FakeCore(self)
+        self._studio = FakeStudio(self)
+
+    def get_core(self):
+        return self._core
+
+    def get_studio(self):
+        return self._studio
+
+    def _get_java_class(self, classpath, new_socket=False):
+        if classpath != 'org.micromanager.acquisition.SequenceSettings':
+            raise ValueError(classpath)
+        java_class = FakeSequenceSettingsClass(self)
+        if new_socket:
+            java_class._socket = FakeSocket()
+        return java_class
+
+    def _construct_java_object(self, classpath, new_socket=False, args=None):
+        if classpath == 'org.micromanager.Studio':
+            proxy = FakeStudio(self)
+        elif classpath == 'mmcorej.CMMCore':
+            proxy = FakeCore(self)
+        else:
+            proxy = FakeProxy(self)
+        proxy._socket = FakeSocket()
+        return proxy
+
+    def close(self):
+        pass
+
+
+def make_message(event_class: str, topic: str = 'StandardEvent', **fields) -> bytes:
+    """ Serialize a synthetic event the way the listener expects messages from the server.
+    The fields are base64 encoded into one opaque value, so the message has the same top-level
+    keys as a serialized object from the server: the listener only reads 'class' and 'emitted',
+    the values are only reached through the proxy that FakeClassFactory builds."""
+    message = {'class': EVENT_PACKAGE + event_class,
+               'fields': base64.b64encode(json.dumps(fields).encode()).decode(),
+               'emitted': time.time()}
+    return (topic + ' ' + json.dumps(message, separators=(',', ':'))).encode()
+
+
+class EventGenerator:
+    """ Publishes synthetic events at the given rates (events per second) on a local PUB socket,
+    each kind of event from its own thread."""
+
+    def __init__(self, port: str = SOCKET, stage: float = 10, xy: float = 2, image: float = 10,
+                 mda: float = 0.1, live: float = 0.05, settings: float = 1,
+                 image_shape=(2048, 2048)):
+        self.rates = {'stage': stage, 'xy': xy, 'image': image, 'mda': mda, 'live': live,
+                      'settings': settings}
+        self.image_shape = image_shape
+        self.context = zmq.Context.instance()
+        self.socket = self.context.socket(zmq.PUB)
+        self.socket.setsockopt(zmq.SNDHWM, 0)
+        self.socket.bind("tcp://*:" + str(port))
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+        self.sent = {kind: 0 for kind in self.rates}
+        self.rng = np.random.default_rng()
+
+    def message(self, kind: str, n: int) -> bytes:
+        if kind == 'stage':
+            return make_message('DefaultStagePositionChangedEvent',
+                                pos=100 + 10*np.sin(n/20), device='Z')
+        if kind == 'xy':
+            return make_message('XYStagePositionChangedEvent', x_pos=float(n % 100),
+                                y_pos=float(n // 100))
+        if kind == 'image':
+            return make_message('DefaultNewImageEvent', topic='ImageEvent',
+                                image={'width': self.image_shape[0],
+                                       'height': self.image_shape[1], 't': n, 'c': 0, 'z': 0,
+                                       'elapsed': n*10.})
+        if kind == 'mda':
+            settings = dict(DEFAULT_SETTINGS)
+            settings['interval_ms'] = int(self.rng.integers(0, 3))*1000
+            return make_message('CustomMDAEvent', settings=settings)
+        if kind == 'live':
+            return make_message('DefaultLiveModeEvent', is_on=bool(n % 2 == 0))
+        if kind == 'settings':
+            return make_message('CustomSettingsEvent', device='488_AOTF',
+                                property='Power (% of max)', value=str(n % 100))
+        raise ValueError(kind)
+
+    def _publish(self, kind):
+        interval = 1/self.rates[kind]
+        next_time = time.perf_counter()
+        n = 0
+        while not self._stop.is_set():
+            message = self.message(kind, n)
+            with self._lock:
+                self.socket.send(message)
+            self.sent[kind] += 1
+            n += 1
+            next_time += interval
+            self._stop.wait(max(0, next_time - time.perf_counter()))
+
+    def start(self):
+        for kind, rate in self.rates.items():
+            if rate > 0:
+                thread = threading.Thread(target=self._publish, args=(kind,), daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        # close alone frees the port in the background, the next generator could not bind it
+        self.socket.unbind(self.socket.getsockopt_string(zmq.LAST_ENDPOINT))
+        self.socket.close(linger=0)
+
+
+def run_headless(duration: float, port: str, bridge: FakeBridge):
+    """ Run the EventThread against the fake bridge and count the signals that arrive """
+    import sys
+    from PyQt5.QtCore import QCoreApplication, QTimer
+    from event_threadQ import EventThread
+
+    app = QCoreApplication(sys.argv)
+    event_thread = EventThread(address="tcp://localhost:" + str(port), bridge=bridge)
+    listener = event_thread.listener
+    counts = {}
+    for name in ['stage_position_changed_event', 'xy_stage_position_changed_event',
+                 'new_image_event', 'settings_event', 'mda_settings_event', 'live_mode_event']:
+        counts[name] = 0
+        getattr(listener, name).connect(
+            lambda *args, name=name: counts.__setitem__(name, counts[name] + 1))
+    QTimer.singleShot(int(duration*1000), app.quit)
+    app.exec_()
+    listener.stop()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--port', default=SOCKET)
+    for kind, rate in [('stage', 10), ('xy', 2), ('image', 10), ('mda', 0.1), ('live', 0.05),
+                       ('settings', 1)]:
+        parser.add_argument('--' + kind, type=float, default=rate, help='Events per second')
+    parser.add_argument('--latency', type=float, default=0.001, help='Seconds per Java call')
+    parser.add_argument('--headless', type=float, default=None,
+                        help='Also run the EventThread on a fake bridge for this many seconds')
+    args = parser.parse_args()
+
+    generator = EventGenerator(args.port, stage=args.stage, xy=args.xy, image=args.image,
+                               mda=args.mda, live=args.live, settings=args.settings)
+    generator.start()
+    try:
+        if args.headless is not None:
+            bridge = FakeBridge(latency=args.latency)
+            counts = run_headless(args.headless, args.port, bridge)
+            print('Signals emitted: ', counts)
+            print('Java calls: ', bridge.calls)
+        else:
+            print('Publishing events, stop with Ctrl+C')
+            while True:
+                time.sleep(0.1)
+    except KeyboardInterrupt:
+        pass
+    generator.stop()
+    print('Events sent: ', generator.sent)
+
+
+if __name__ == '__main__':
+    main()
@@ -11,9 +11,16 @@ from pyqtgraph import GraphicsLayoutWidget, ImageItem, PlotWidget, PlotCurveItem
 from threading import Thread
 from event_threadQ import EventThread
 from MonogramCC import MonogramCC
-from scipy.ndimage import center_of_mass
+from gui.tiled_map import TiledMap, TiledMapItem
+from history_store import HistoryStore
+from gui.alignment_worker import AlignmentAnalyzer
+from gui.render_scheduler import RenderScheduler
+from dose import DoseIntegrator
 
 from data_structures import MMSettings
+from logger import get_logger
+
+log = get_logger("gui")
 
 # Adjust for different screen sizes
 QtWidgets.QApplication.setAttribute(QtCore.Qt.HighDpiScaleFactorRoundingPolicy.PassThrough)
@@ -50,10 +57,12 @@ class FocusSlider(QtWidgets.QSlider):
         self.monogram.monogram_stage_position_event.connect(self.monogram_event)
 
     def z_value_changed(self, pos):
-        self.repaint()
+        # Schedule a paint instead of painting right away, several changes before the next
+        # refresh of the screen are drawn once
+        self.update()
 
         if self.my_event:
-            print('Slider sending event')
+            log.debug("Slider sending event")
             self.z_stage_position_python.emit(pos/100)
             self.my_event = False
 
@@ -114,138 +123,107 @@ class PositionHistory(QtWidgets.QGraphicsView):
     """ This is a widget that records the history of where the stage of the microscope has
     been for the given sample. It visualizes the time spent at a specific position on a grid
     with rectangles that get brighter for the more time spent at a position. This is also
-    dependent on if the laser light was on at the given time."""
+    dependent on the light dose, NIDAQ reports the dose rate of what it is running. The map has no
+    borders, the view follows the stage and can be zoomed with the mouse wheel. With a store, the
+    history is saved to disk as it is recorded and continued when it is opened again."""
     xy_stage_position_python = QtCore.pyqtSignal(object)
 
-    def __init__(self, parent:QtWidgets.QWidget=None):
+    def __init__(self, parent:QtWidgets.QWidget=None, store: HistoryStore = None):
         super(PositionHistory, self).__init__(QtWidgets.QGraphicsScene(), parent=parent)
-        # Set the properties for the window so that everything is shown and we don't have Scrollbars
+        # Area that is shown at the start, in stage units
         self.view_size = (3000, 3000)
         self.setBaseSize(self.view_size[0], self.view_size[1])
-        self.fitInView(0, 25, self.view_size[0], self.view_size[1] - 50,
-                       QtCore.Qt.AspectRatioMode.KeepAspectRatio)
-        self.setSceneRect(0, 25, self.view_size[0], self.view_size[1] - 50)
+        # Large enough to center on any position the stage can reach
+        self.setSceneRect(-1e7, -1e7, 2e7, 2e7)
         self.setVerticalScrollBarPolicy(QtCore.Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
         self.setHorizontalScrollBarPolicy(QtCore.Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        self.setBackgroundBrush(QtGui.QBrush(QtGui.QColorConstants.Black))
 
         # Initialize the position of the stage and the parameters
         self.stage_pos = [0, 0]
         self.fov_size = (81, 81)
-        self.sample_size = self.view_size
         pos = self.rectangle_pos(self.stage_pos)
 
         # Get the components of the GUI ready
-        self.map = QtGui.QImage(self.sample_size[0], self.sample_size[1],
-                                QtGui.QImage.Format.Format_RGB32)
-
-        self.pixmap = self.scene().addPixmap(QtGui.QPixmap.fromImage(self.map))
+        # Same brightness for the same laser power as when a second was added per second
+        self.store = store
+        self.map = TiledMapItem(TiledMap(store=store), scale=100)
+        self.scene().addItem(self.map)
         self.now_rect = self.scene().addRect(QtCore.QRectF(0, 0,
                                                            self.fov_size[0], self.fov_size[1]),
                                              QtGui.QPen(Colors().blue,4),
                                              QtGui.QBrush(QtGui.QColorConstants.Transparent))
         self.now_rect.setPos(pos[0], pos[1])
-        self.arrow = self.scene().addPolygon(self.oof_arrow(),
-                                QtGui.QPen(QtGui.QColorConstants.Transparent),
-                                QtGui.QBrush(Colors().blue))
-        self.arrow.setPos(100,100)
-        self.arrow.setVisible(0)
         self.rect = QtCore.QRectF(pos[0], pos[1],
                                  self.fov_size[0], self.fov_size[1])
+        self.zoom = 1.
+        self.fit_view()
 
-        self.laser = True
-        self.stage_offset = [0, 0]
+        self.dose = DoseIntegrator()
+        self.stage_offset = [0, 0] if store is None else store.meta.get('stage_offset', [0, 0])
 
-        # Start a Timer that checks if the laser is on and enhances at that position
-        self.timer = QtCore.QTimer()
-        self.timer.timeout.connect(self.increase_values)
-        self.timer.start(1_000)
+        # Write the changed tiles and the positions to disk every now and then
+        self.save_timer = QtCore.QTimer()
+        self.save_timer.timeout.connect(self.save)
+        if store is not None:
+            self.save_timer.start(30_000)
 
 
     def stage_moved(self, new_pos):
+        # The dose since the last move was collected at the old position
+        self.increase_values()
         self.stage_pos = new_pos
         pos = self.rectangle_pos(list(map(operator.sub, new_pos, self.stage_offset)))
         self.rect = QtCore.QRectF(pos[0], pos[1], self.fov_size[0], self.fov_size[1])
-        # self.painter.drawRect(self.rect)
-        self.pixmap.setPixmap(QtGui.QPixmap.fromImage(self.map))
         self.now_rect.setPos(QtCore.QPointF(pos[0], pos[1]))
-        self.set_oof_arrow()
-        self.repaint()
+        self.centerOn(self.now_rect)
         self.xy_stage_position_python.emit(new_pos)
 
     def rectangle_pos(self, pos):
-        rect_pos = [int(self.sample_size[0]*0.5 + pos[0] - self.fov_size[0]/2),
-                    int(self.sample_size[1]*0.5 + pos[1] - self.fov_size[1]/2)]
+        rect_pos = [int(pos[0] - self.fov_size[0]/2),
+                    int(pos[1] - self.fov_size[1]/2)]
         return rect_pos
 
-    def set_oof_arrow(self):
-        pos = self.rectangle_pos(list(map(operator.sub, self.stage_pos, self.stage_offset)))
-        y = self.check_limits(pos[1]+self.fov_size[1]/2)
-        x = self.check_limits(pos[0]+self.fov_size[0]/2)
-        self.arrow.setVisible(1)
-        offset = 25
-        if x == offset and y == offset:
-            self.arrow.setPos(QtCore.QPointF(offset, offset))
-            self.arrow.setRotation(-45)
-        elif x == offset and y == self.sample_size[0]-offset:
-            self.arrow.setPos(QtCore.QPointF(offset, self.sample_size[1]-offset))
-            self.arrow.setRotation(-135)
-        elif x == self.sample_size[0]-offset and y == self.sample_size[0]-offset:
-            self.arrow.setPos(QtCore.QPointF(self.sample_size[0]-offset, self.sample_size[1]-offset))
-            self.arrow.setRotation(135)
-        elif x == self.sample_size[0]-offset and y == offset:
-            self.arrow.setPos(QtCore.QPointF(self.sample_size[0]-offset, offset))
-            self.arrow.setRotation(45)
-        elif pos[0] - self.sample_size[0]/2 > self.sample_size[0]/2:
-            self.arrow.setPos(QtCore.QPointF(self.sample_size[0]-offset, y))
-            self.arrow.setRotation(90)
-        elif pos[0] - self.sample_size[0]/2  < -self.sample_size[0]/2:
-            self.arrow.setRotation(-90)
-            self.arrow.setPos(QtCore.QPointF(offset, y))
-        elif pos[1] - self.sample_size[1]/2 < -self.sample_size[1]/2:
-            self.arrow.setRotation(0)
-            self.arrow.setPos(QtCore.QPointF(x, offset))
-        elif pos[1] - self.sample_size[1]/2  > self.sample_size[1]/2:
-            self.arrow.setRotation(180)
-            self.arrow.setPos(QtCore.QPointF(x, self.sample_size[1]-offset))
-        else:
-            self.arrow.setVisible(0)
-
-    def check_limits(self, pos):
-        if pos < 0:
-            pos = 25
-        elif pos > self.sample_size[0]:
-            pos = self.sample_size[0]-25
-        return pos
-
-    def oof_arrow(self):
-        arrow = QtGui.QPolygonF()
-        arrow.append(QtCore.QPointF(-20, 0))
-        arrow.append(QtCore.QPointF(0,-20))
-        arrow.append(QtCore.QPointF(20, 0))
-        arrow.append(QtCore.QPointF(-20, 0))
-        return arrow
-
-    def increase_values(self):
-        self.painter = self.define_painter()
-        if self.laser:
-            color = QtGui.QColor(255, 255, 255)
-            color.setAlpha(self.laser)
-            self.painter.brush().setColor(color)
-            self.painter.drawRect(self.rect)
-            self.pixmap.setPixmap(QtGui.QPixmap.fromImage(self.map))
-        self.painter.end()
-
-    def define_painter(self, alpha=10):
-        painter = QtGui.QPainter(self.map)
-        color = QtGui.QColor(255, 255, 255)
-        color.setAlpha(alpha)
-        brush = QtGui.QBrush(color)
-        painter.setBrush(brush)
-        painter.setPen(QtGui.QPen(QtGui.QColorConstants.Transparent))
-        return painter
+    def increase_values(self, dose: float = None):
+        dose = self.dose.take() if dose is None else dose
+        if dose > 0:
+            self.map.add(self.rect, dose)
+        if self.store is not None:
+            center = self.rect.center()
+            self.store.append_log(center.x(), center.y(), dose)
+
+    def save(self):
+        if self.store is not None:
+            self.map.map.flush()
+            self.store.flush_log()
+
+    def close_store(self):
+        """ Save everything, call when the program is closed """
+        self.increase_values()
+        if self.store is not None:
+            self.save()
+            self.store.close()
+
+    @QtCore.pyqtSlot(float)
+    def set_dose_rate(self, rate: float):
+        """ Dose rate in full power seconds per second, see dose.py """
+        self.increase_values(self.dose.set_rate(rate))
+
+    def fit_view(self):
+        """ Show view_size/zoom around the current position """
+        self.resetTransform()
+        scale = min(self.viewport().width()/self.view_size[0],
+                    self.viewport().height()/self.view_size[1])*self.zoom
+        self.scale(scale, scale)
+        self.centerOn(self.now_rect)
+
+    def wheelEvent(self, event):
+        self.zoom *= 1.25 if event.angleDelta().y() > 0 else 0.8
+        self.fit_view()
+        event.accept()
 
     def keyPressEvent(self, event):
-        print("KEY pressed: ", event.key())
+        log.debug("Key pressed: %s", event.key())
         if event.key() == 16777236:
             event.accept
             self.stage_pos[0] = self.stage_pos[0] + self.fov_size[0]
@@ -263,22 +241,24 @@ class PositionHistory(QtWidgets.QGraphicsView):
             self.stage_pos[1] = self.stage_pos[1] + self.fov_size[1]
             self.stage_moved(self.stage_pos)
         if event.key() == 16777220:
-            self.painter.end()
-            self.map = QtGui.QImage(self.sample_size[0], self.sample_size[1],
-                                    QtGui.QImage.Format.Format_Grayscale8)
-            self.pixmap.setPixmap(QtGui.QPixmap.fromImage(self.map))
+            # Start over for a new sample
+            self.dose.take()
+            store = None
+            if self.store is not None:
+                self.save()
+                self.store.close()
+                store = HistoryStore.new(self.store.path.parent)
+            self.store = store
+            self.map.clear(store)
             # self.stage_pos = [0, 0]
             self.stage_offset = copy.deepcopy(self.stage_pos)
-            self.painter = self.define_painter()
-            self.repaint()
+            if self.store is not None:
+                self.store.meta = {'stage_offset': self.stage_offset}
             self.stage_moved(self.stage_pos)
 
     def resizeEvent(self, event):
-        self.setSceneRect(0, 25, self.view_size[0], self.view_size[1] - 50)
         self.setBaseSize(self.view_size[0], self.view_size[1])
-        self.fitInView(0, 25, self.view_size[0], self.view_size[1] - 50,
-                       QtCore.Qt.AspectRatioMode.KeepAspectRatio)
-
+        self.fit_view()
 
 
 class LiveView(QtWidgets.QGraphicsView):
@@ -294,6 +274,9 @@ class LiveView(QtWidgets.QGraphicsView):
         self.setSceneRect(0, 0, *shape)
 
     def set_qimage(self, image: QtGui.QImage):
+        if image.size() != self.image.pixmap().size():
+            self.reset_scene_rect((image.width(), image.height()))
+            self.fitInView(self.sceneRect(), QtCore.Qt.KeepAspectRatio)
         self.image.setPixmap(QtGui.QPixmap.fromImage(image))
         self.update()
 
@@ -309,36 +292,55 @@ class AlignmentWidget(QtWidgets.QWidget):
 
         self.pixmap = QtGui.QPixmap(width,height)
         grid = QtWidgets.QGridLayout(self)
+        # One worker analyzes the latest frame of all three views, one timer draws them
+        self.analyzer = AlignmentAnalyzer()
+        self.renderer = RenderScheduler()
         top_bottom_offset = np.tan(0.063948864)*(1024-height/2) - self.window_offset
         self.view_top = AlignmentView(line_offset= - top_bottom_offset,
-                                      expected_shape=(width,height))
-        self.view_center = AlignmentView(center = True, expected_shape=(width,height))
+                                      expected_shape=(width,height), analyzer=self.analyzer,
+                                      renderer=self.renderer, name="AlignmentView.top")
+        self.view_center = AlignmentView(center = True, expected_shape=(width,height),
+                                         analyzer=self.analyzer, renderer=self.renderer,
+                                         name="AlignmentView.center")
         self.view_center.viewBox.disableAutoRange()
         self.view_center.viewBox.setRange(xRange = (35,105), yRange=(35,105))
         self.view_center.viewBox.setMouseMode(self.view_center.viewBox.RectMode)
         self.view_bottom = AlignmentView(line_offset=top_bottom_offset,
-                                         expected_shape=(width,height))
+                                         expected_shape=(width,height), analyzer=self.analyzer,
+                                         renderer=self.renderer, name="AlignmentView.bottom")
         grid.addWidget(self.view_top, 0, 1)
         grid.addWidget(self.view_center, 0, 0, 2, 1)
         grid.addWidget(self.view_bottom, 1, 1)
         self.size = int(width/2)
+        # Regions of the frame shown in the views as (x, y, width, height), see
+        # EventListener.register_rois
+        self.rois = {'alignment_top': (1024-self.size-self.window_offset, 0, width, height),
+                     'alignment_center': (1024-self.size, 1024-self.size, width, height),
+                     'alignment_bottom': (1024-self.size+self.window_offset, 2048-height,
+                                          width, height)}
 
     def add_image(self, image):
-        qimage = image.raw_image
+        self.view_top.set_qimage(image.roi('alignment_top', self.rois['alignment_top']))
+        self.view_center.set_qimage(image.roi('alignment_center', self.rois['alignment_center']))
+        self.view_bottom.set_qimage(image.roi('alignment_bottom', self.rois['alignment_bottom']))
 
-        self.view_top.set_qimage(qimage[0:self.size*2,
-                                        1024-self.size-self.window_offset:1024+self.size-self.window_offset])
-        self.view_center.set_qimage(qimage[1024-self.size:1024+self.size,
-                                           1024-self.size:1024+self.size])
-        self.view_bottom.set_qimage(qimage[2048-self.size*2:2048,
-                                           1024-self.size+self.window_offset:1024+self.size+self.window_offset])
+    def closeEvent(self, event):
+        self.analyzer.stop()
+        self.renderer.stop()
+        super().closeEvent(event)
 
 
 class AlignmentView(GraphicsLayoutWidget):
-    """ Extend live view with functionality for alignment """
+    """ Extend live view with functionality for alignment. The peaks are found and fitted by an
+    AlignmentAnalyzer in the background, the view only draws the results. The image is drawn by a
+    RenderScheduler, at most once per refresh of the screen."""
+    # Sharpness and evenness of the spots, see spot_analysis.alignment_quality
+    quality_event = QtCore.pyqtSignal(dict)
 
     def __init__(self, parent=None, center:bool = False,
-                 line_offset:float = 0., expected_shape:Tuple = (160, 160)):
+                 line_offset:float = 0., expected_shape:Tuple = (160, 160),
+                 analyzer: AlignmentAnalyzer = None, renderer: RenderScheduler = None,
+                 name: str = "AlignmentView"):
         super(AlignmentView, self).__init__(parent=parent)
         self.setSceneRect(0, 0, expected_shape[0], expected_shape[1])
         self.viewBox = self.addViewBox()
@@ -350,92 +352,43 @@ class AlignmentView(GraphicsLayoutWidget):
         self.raw_data = np.ones(expected_shape)
         self.pointer_radius = 5
         self.pointers = []
-        self.old_pointers = []
-        self.peaks = []
         self.peak_pos = []
         self.window_size = 20
-        self.fit_number = 0
-
+        self.quality = {}
 
         self.line = LineItem(center=center, offset=line_offset, shape=expected_shape)
         self.viewBox.addItem(self.line)
 
-        self.peak_timer = QtCore.QTimer()
-        self.peak_timer.timeout.connect(self.update_peaks)
-        self.peak_timer.start(5000)
-        self.fit_timer = QtCore.QTimer()
-        self.fit_timer.timeout.connect(self.update_peak_location)
-        self.fit_timer.start(500)
-
-    def update_peaks(self):
-        self.reset_line()
-        self.get_peaks()
-
-    def update_peak_location(self):
-        self.fit_peaks()
-        self.set_pointers()
+        self.analyzer = AlignmentAnalyzer(self.window_size) if analyzer is None else analyzer
+        self.analyzer.register(id(self)).peaks_event.connect(self.set_peaks)
+        self.renderer = RenderScheduler() if renderer is None else renderer
+        # Views that share a renderer need distinct names to tell their stats apart
+        self.renderer.register(self, self.draw_image, name=name)
 
     def set_qimage(self, image_data):
         self.raw_data = image_data
+        self.analyzer.submit(id(self), image_data)
+        self.renderer.submit(self, image_data)
+
+    def draw_image(self, image_data):
         self.pg_image.setImage(image_data)
         self.update()
 
-    def get_peaks(self):
-        self.fit_timer.stop()
-        data = np.copy(self.raw_data)
-        mean_image = np.mean(data)
-        data[:self.window_size,:] = mean_image * np.ones_like(data[:self.window_size,:])
-        data[:,:self.window_size] = mean_image * np.ones_like(data[:,:self.window_size])
-        data[-self.window_size:,:] = mean_image * np.ones_like(data[-self.window_size:,:])
-        data[:,-self.window_size:] = mean_image * np.ones_like(data[:,-self.window_size:])
-        max_value = 1000000
-
-        self.old_pointers = self.pointers
-        self.pointers = []
-        self.peaks = []
-        while max_value > mean_image*1.5:
-            max_value = np.max(data)
-            max_pixel = np.where(data == max_value)
-            max_pixel = [int(pixel[0]) for pixel in max_pixel]
-            if np.min(max_pixel) > self.window_size and max_pixel[0] < data.shape[0]-self.window_size and max_pixel[1] < data.shape[1]-self.window_size:
-                data[max_pixel[0]-self.window_size:max_pixel[0]+self.window_size+1,
-                     max_pixel[1]-self.window_size:max_pixel[1]+self.window_size+1] = np.zeros((self.window_size*2+1,
-                                                                                                self.window_size*2+1))
-                self.peaks.append(max_pixel)
-                self.add_pointer()
-                if len(self.peaks) > 16:
-                    break
-            else:
-                data[max_pixel[0], max_pixel[1]] = np.mean(data)
-        self.fit_number = 0
-        self.fit_timer.start()
-
-    def fit_peaks(self):
-        data = np.copy(self.raw_data)
-        self.peak_pos = []
-
-        for index, peak in enumerate(self.peaks):
-            peak_data = data[peak[0]-self.window_size:peak[0]+self.window_size+1,
-                             peak[1]-self.window_size:peak[1]+self.window_size+1]
-            mask = peak_data < np.mean(peak_data)*1.5
-            peak_data[mask] = 0
-            x, y = center_of_mass(peak_data)
-            x_image = peak[0] + x - (self.window_size - 0.5)
-            y_image = peak[1] + y - (self.window_size - 0.5)
-            self.peak_pos.append([x_image, y_image])
-        self.fit_number += 1
-
-
-    def set_pointers(self):
-        if self.fit_number == 1:
-            for pointer in self.old_pointers:
-                self.viewBox.removeItem(pointer)
-        for index, peak in enumerate(self.peak_pos):
-            pointer = self.pointers[index]
+    @QtCore.pyqtSlot(object, dict)
+    def set_peaks(self, positions, quality):
+        """ Results of the analyzer for the frames of this view """
+        self.reset_line()
+        self.peak_pos = positions.tolist()
+        self.quality = quality
+        while len(self.pointers) < len(self.peak_pos):
+            self.add_pointer()
+        for pointer, peak in zip(self.pointers, self.peak_pos):
             pointer.setPosition(peak)
-        if self.fit_number == 1:
-            for pointer in self.pointers:
-                pointer.show()
+            pointer.show()
+        for pointer in self.pointers[len(self.peak_pos):]:
+            pointer.hide()
+        self.quality_event.emit(quality)
+        log.debug("Alignment quality %s", quality)
 
     def add_pointer(self):
         pointer = CrossItem()
@@ -476,7 +429,6 @@ class LineItem(GraphicsObject):
         """ Generate the line. The size should at some point be set depending on the Range of
         the ViewBox for example to ensure always the same apparent size. """
         size = self.shape
-        print(size)
         painter = QtGui.QPainter(self.picture)
         painter.setPen(mkPen(color=self.color, width=2))
         dx = np.tan(self.angle)*size[1]/2
@@ -541,28 +493,62 @@ class CrossItem(GraphicsObject):
 
 
 class RunningMean(PlotWidget):
-    def __init__(self, *args, **kwargs):
+    """ Plots the mean of the brightest pixels in the center of each image, smoothed over the last
+    frames. Adding a value is O(1), the plot is only redrawn at max_fps."""
+    def __init__(self, *args, length: int = 200, smoothing: int = 6, top_n: int = 20,
+                 max_fps: float = 30, **kwargs):
         super().__init__(*args, **kwargs)
         self.mean = PlotCurveItem([], pen=QtGui.QPen(QtGui.QColor('#505050')))
         self.addItem(self.mean)
-        self.means = []
         self.window_size = int(300/2)
+        self.rois = {'running_mean': (1024-self.window_size, 1024-self.window_size,
+                                      2*self.window_size, 2*self.window_size)}
+        self.top_n = top_n
+        # Ring buffer of the smoothed values that are plotted
+        self.means = np.zeros(length)
+        self._plot_data = np.zeros(length)
+        # Ring buffer of the last raw values with their sum for the moving average
+        self.raw = np.zeros(smoothing)
+        self._raw_sum = 0.
+        self.count = 0
+        self._dirty = False
+
+        self.refresh_timer = QtCore.QTimer()
+        self.refresh_timer.timeout.connect(self.refresh)
+        self.refresh_timer.start(int(1000/max_fps))
 
     def add_image(self, image):
-        image = image.raw_image[1024-self.window_size:1024 + self.window_size,
-                                1024-self.window_size:1024 + self.window_size].flatten()
-        sorted_image = np.sort(image)
-        self.add_value(np.mean(sorted_image[-20:]))
-
+        roi = image.roi('running_mean', self.rois['running_mean'])
+        # Only the top_n values have to be in place, no need to sort all of them
+        brightest = np.partition(roi, -self.top_n, axis=None)[-self.top_n:]
+        self.add_value(brightest.mean())
 
     def add_value(self, new_value):
-        if len(self.means) >= 200:
-            self.means.pop(0)
-        if len(self.means) > 5:
-            self.means.append(np.mean(self.means[-5:] + [new_value]))
-        else:
-            self.means.append(new_value)
-        self.mean.setData(self.means)
+        slot = self.count % self.raw.size
+        self._raw_sum += new_value - self.raw[slot]
+        self.raw[slot] = new_value
+        self.count += 1
+        if slot == self.raw.size - 1:
+            # Don't let rounding errors add up
+            self._raw_sum = self.raw.sum()
+        self.means[(self.count - 1) % self.means.size] = \
+            self._raw_sum/min(self.count, self.raw.size)
+        self._dirty = True
+
+    def values(self) -> np.ndarray:
+        """ The smoothed values, oldest first """
+        length = self.means.size
+        if self.count <= length:
+            return self.means[:self.count]
+        start = self.count % length
+        self._plot_data[:length - start] = self.means[start:]
+        self._plot_data[length - start:] = self.means[:start]
+        return self._plot_data
+
+    def refresh(self):
+        if self._dirty:
+            self.mean.setData(self.values())
+            self._dirty = False
 
 
 class SettingsView(QtWidgets.QWidget):
@@ -2,12 +2,17 @@ import MicroManagerControl
 from PyQt5.QtCore import pyqtSlot
 from .qt_classes import QWidgetRestore
 from gui.GUIWidgets import LiveView, PositionHistory, FocusSlider, AlignmentWidget, RunningMean
+from gui.render_scheduler import RenderScheduler
 from event_threadQ import EventThread
 from MonogramCC import MonogramCC
 from PyQt5 import QtWidgets, QtCore
 import sys
 import time
 import numpy as np
+from history_store import HistoryStore
+from logger import get_logger
+
+log = get_logger("gui")
 
 # Adjust for different screen sizes
 QtWidgets.QApplication.setAttribute(QtCore.Qt.HighDpiScaleFactorRoundingPolicy.PassThrough)
@@ -15,27 +20,39 @@ QtWidgets.QApplication.setAttribute(QtCore.Qt.HighDpiScaleFactorRoundingPolicy.P
 class MainGUI(QWidgetRestore):
     """ Makes a mini App that shows of the capabilities of the Widgets implemented here """
 
-    def __init__(self, parent=None, monogram:bool = True, event_thread = None):
+    def __init__(self, parent=None, monogram:bool = True, event_thread = None,
+                 live_view: bool = False, history: bool = False):
         super(MainGUI, self).__init__()
-        self.position_history = PositionHistory()
+        # Only the program keeps the history on disk, test and widget runs don't touch it
+        self.position_history = PositionHistory(store=HistoryStore.latest() if history else None)
         self.focus_slider = FocusSlider()
-        # self.live_view = LiveView()
+        # Mirror of the camera images, needs the full frames from the event thread
+        self.live_view = LiveView() if live_view else None
         # self.alignment_widget = AlignmentWidget()
+        # Frames are only converted and drawn at the refresh rate of the screen
+        self.renderer = RenderScheduler()
+        self.renderer.register('live', self.draw_image, name="LiveView")
         try:  # this makes sense only if Micro-Manager is running
             if event_thread == None:
-                self.event_thread = EventThread()
-                self.event_thread.start()
+                # Keep the owner, it closes the sockets and dumps the metrics when the listener
+                # stops
+                self._event_thread = EventThread()
+                self.event_thread = self._event_thread.listener
             else:
+                self._event_thread = None
                 self.event_thread = event_thread
             self.event_thread.xy_stage_position_changed_event.connect(self.set_xy_pos)
             self.event_thread.stage_position_changed_event.connect(self.set_z_pos)
-            # self.event_thread.new_image_event.connect(self.set_image)
+            if self.live_view is not None:
+                self.event_thread.register_rois(self.live_view, {}, full_frame=True)
+                self.event_thread.new_image_event.connect(self.set_image)
             self.event_thread.acquisition_started_event.connect(self.set_bit_depth)
             self.event_thread.settings_event.connect(self.handle_settings)
             self.event_thread.mda_settings_event.connect(self.handle_mda_settings)
 
             # Init the focus slider position
-            self.focus_slider.setValue(self.event_thread.bridge.get_core().get_position()*100)
+            z_position = self.event_thread.bridge.get_core().get_position()
+            self.focus_slider.setValue(int(round(z_position*100)))
 
             self.mm_interface = MicroManagerControl.MicroManagerControl(event_thread=self.event_thread)
             self.position_history.xy_stage_position_python.connect(self.set_xy_position_python)
@@ -44,12 +61,12 @@ class MainGUI(QWidgetRestore):
             print(error)
             print('No, will work as Test Widgets')
 
+        self.monogram = None
         try:
-            # This makes sense only if the controller is connected
+            # This makes sense only if the controller is connected. main opens it during startup
+            # and connects it later, see connect_monogram
             if monogram:
-                self.monogram = MonogramCC()
-                self.focus_slider.connect_monogram(self.monogram)
-                self.monogram.monogram_stop_live_event.connect(self.mm_interface.stop_live)
+                self.connect_monogram(MonogramCC())
 
         except OSError as error:
             print(error)
@@ -57,16 +74,24 @@ class MainGUI(QWidgetRestore):
         self.setLayout(QtWidgets.QHBoxLayout())
         self.layout().addWidget(self.position_history)
         self.layout().addWidget(self.focus_slider)
-        # self.layout().addWidget(self.live_view)
+        if self.live_view is not None:
+            self.layout().addWidget(self.live_view)
         # self.layout().addWidget(self.alignment_widget)
         self.setStyleSheet("background-color:black;")
 
+    def connect_monogram(self, monogram: MonogramCC):
+        self.monogram = monogram
+        self.focus_slider.connect_monogram(self.monogram)
+        self.monogram.monogram_stop_live_event.connect(self.mm_interface.stop_live)
+
     @pyqtSlot(float)
     def set_z_pos(self, pos):
+        self.event_thread.metrics.slot_entry("stage_position_changed_event")
         self.focus_slider.setValue(int(np.round(pos)))
 
     @pyqtSlot(object)
     def set_xy_pos(self, pos):
+        self.event_thread.metrics.slot_entry("xy_stage_position_changed_event")
         self.position_history.blockSignals(True)
         self.position_history.stage_pos[0] = pos[0]
         self.position_history.stage_pos[1] = pos[1]
@@ -82,9 +107,8 @@ class MainGUI(QWidgetRestore):
 
     @pyqtSlot(float)
     def set_z_position_python(self, pos):
-        self.event_thread.blockSignals(True)
-        self.mm_interface.set_z_position(pos)
-        self.event_thread.blockSignals(False)
+        # Only the latest position is sent, the echo of the stage is held back by blockZ
+        self.mm_interface.request_z_position(pos)
 
 
     @pyqtSlot()
@@ -94,16 +118,20 @@ class MainGUI(QWidgetRestore):
     @pyqtSlot(object)
     def set_image(self, evt):
         image = evt.raw_image
+        if image is None:
+            # Only regions were fetched for other widgets
+            return
         # image = image.get_raw_pixels().reshape([image.shape[0], image.shape[1]])
-        self.live_view.set_qimage(self.mm_interface.convert_image(image))
+        self.renderer.submit('live', image)
         # self.alignment_widget.add_image(image)
 
+    def draw_image(self, image):
+        self.live_view.set_qimage(self.mm_interface.convert_image(image))
+
     @pyqtSlot(str, str, str)
     def handle_settings(self, device, deviceProperty, value):
-        print(deviceProperty)
-        if device == "Dummy_488_Power" and deviceProperty == 'Power (% of max)':
-            self.position_history.laser = float(value)
-            print(self.position_history.laser)
+        self.event_thread.metrics.slot_entry("settings_event")
+        log.debug("%s %s %s", device, deviceProperty, value)
 
     @pyqtSlot(object)
     def handle_mda_settings(self, settings):
@@ -111,11 +139,15 @@ class MainGUI(QWidgetRestore):
 
     def closeEvent(self, event):
         try:
+            # Stopping the listener also stops the EventThread that owns it
             self.event_thread.stop()
         except AttributeError:
             # Event Thread was not added in the first place
             pass
-        self.monogram.thread.quit()
+        self.position_history.close_store()
+        self.renderer.stop()
+        if self.monogram is not None:
+            self.monogram.thread.quit()
         self.mm_interface.close()
         super().closeEvent(event)
         event.accept()
@@ -130,10 +162,12 @@ class AlignmentGUI(QtWidgets.QWidget):
         self.view = AlignmentWidget()
         self.view.setFixedWidth(1800)
         try:  # this makes sense only if Micro-Manager is running
-            self.event_thread = EventThread()
-            self.event_thread.start()
-            self.event_thread.new_image_event.connect(self.mean.add_image)
-            self.event_thread.new_image_event.connect(self.view.add_image)
+            self._event_thread = EventThread()
+            self.event_thread = self._event_thread.listener
+            # Only the regions the widgets show are transferred, not the full frames
+            self.event_thread.register_rois(self.mean, self.mean.rois)
+            self.event_thread.register_rois(self.view, self.view.rois)
+            self.event_thread.new_image_event.connect(self.add_image)
         except TimeoutError as error:
             print(error)
             print('No, will work as Test Widgets')
@@ -143,6 +177,22 @@ class AlignmentGUI(QtWidgets.QWidget):
         self.layout().addWidget(self.view)
         self.setStyleSheet("background-color:black;")
 
+    @pyqtSlot(object)
+    def add_image(self, image):
+        self.event_thread.metrics.slot_entry("new_image_event")
+        self.mean.add_image(image)
+        self.view.add_image(image)
+
+    def closeEvent(self, event):
+        try:
+            self.event_thread.stop()
+        except AttributeError:
+            pass
+        # The AlignmentWidget does not get a closeEvent as a child of this window
+        self.view.renderer.stop()
+        self.view.analyzer.stop()
+        super().closeEvent(event)
+
 
 def main():
     app = QtWidgets.QApplication(sys.argv)
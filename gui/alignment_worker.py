@@ -0,0 +1,101 @@
+""" Peak finding and fitting for the AlignmentViews in a background thread. Frames are handed over
+with submit, only the latest frame of each view is kept, so the analysis never queues up behind the
+camera. Every view registers its key and only gets the spot positions of its own frames back, with
+the peaks_event of the AnalysisResults that register returns."""
+
+import threading
+import time
+
+import numpy as np
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from logger import get_logger
+
+log = get_logger("gui")
+
+
+class AnalysisResults(QObject):
+    # (n, 2) spot positions and alignment_quality of the spots
+    peaks_event = pyqtSignal(object, dict)
+
+
+class AlignmentAnalyzer(QObject):
+    def __init__(self, window_size: int = 20, peak_interval: float = 5., fit_interval: float = 0.1):
+        super().__init__()
+        self.window_size = window_size
+        # Searching for the peaks again is only needed if the spots moved a lot
+        self.peak_interval = peak_interval
+        self.fit_interval = fit_interval
+        self._lock = threading.Lock()
+        self._latest = {}
+        self._peaks = {}
+        self._last_search = {}
+        self._last_fit = {}
+        self._results = {}
+        self._wake = threading.Event()
+        self._stop = False
+        self.received = 0
+        self.analyzed = 0
+        self._thread = threading.Thread(target=self._run, daemon=True, name="alignment")
+        self._thread.start()
+
+    def register(self, key) -> AnalysisResults:
+        """ The results for the frames submitted with key are emitted by the returned object """
+        self._results[key] = AnalysisResults(self)
+        return self._results[key]
+
+    def submit(self, key, image: np.ndarray):
+        """ Hand over a frame, an older one for the same key that was not analyzed yet is dropped """
+        with self._lock:
+            self._latest[key] = image
+            self.received += 1
+        self._wake.set()
+
+    def search_peaks(self, key=None):
+        """ Search for peaks again with the next frame, of one or of all views """
+        with self._lock:
+            for view in ([key] if key is not None else list(self._last_search)):
+                self._last_search.pop(view, None)
+
+    def _run(self):
+        from spot_analysis import find_peaks, fit_spots, alignment_quality
+        timeout = 0.5
+        while not self._stop:
+            self._wake.wait(timeout)
+            self._wake.clear()
+            with self._lock:
+                # Views that were fitted recently wait for their next turn with their latest frame
+                now = time.perf_counter()
+                due = {key: image for key, image in self._latest.items()
+                       if now - self._last_fit.get(key, 0) >= self.fit_interval}
+                for key in due:
+                    del self._latest[key]
+            for key, image in due.items():
+                try:
+                    if now - self._last_search.get(key, -np.inf) >= self.peak_interval:
+                        self._peaks[key] = find_peaks(image, min_distance=self.window_size)
+                        self._last_search[key] = now
+                    fits = fit_spots(image, self._peaks[key], half=self.window_size,
+                                     gaussian=True)
+                except Exception as error:
+                    log.warning("Alignment analysis failed: %s", error)
+                    continue
+                self._last_fit[key] = time.perf_counter()
+                self.analyzed += 1
+                self._results[key].peaks_event.emit(np.stack([fits.row, fits.column], axis=1),
+                                                    alignment_quality(fits))
+            with self._lock:
+                # Come back when the next of the frames that were not due yet is, or earlier with
+                # a new frame
+                next_fit = [self._last_fit.get(key, 0) + self.fit_interval for key in self._latest]
+            if next_fit:
+                timeout = max(min(next_fit) - time.perf_counter(), 0)
+            else:
+                timeout = 0.5
+
+    def stop(self):
+        self._stop = True
+        self._wake.set()
+        self._thread.join(timeout=2)
+        log.info("Alignment analysis: %s frames received, %s analyzed", self.received,
+                 self.analyzed)
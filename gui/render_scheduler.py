@@ -0,0 +1,98 @@
+""" Rendering of camera frames at the refresh rate of the screen instead of at the frame rate of the
+camera. Views hand their frames to a RenderScheduler with submit, which only keeps a reference to the
+newest frame of each view. A timer with the refresh interval then renders the newest frame of every
+view that got a new one, the frames in between are never converted or drawn.
+
+The ticks run at the refresh rate, but they are not synchronized with vsync: with Qt 5,
+QWindow.requestUpdate is only throttled to vsync on some platforms and not on Windows, and
+frameSwapped needs OpenGL widgets. Each tick is scheduled from the exact time of the last one, so
+the rate does not drift against the screen the way a fixed integer interval in ms would."""
+
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+from PyQt5 import QtCore, QtGui
+
+from logger import get_logger
+
+log = get_logger("gui")
+
+
+@dataclass
+class RenderStats:
+    received: int = 0
+    rendered: int = 0
+    skipped: int = 0
+
+
+class RenderScheduler(QtCore.QObject):
+    def __init__(self, max_fps: float = None, parent=None):
+        super().__init__(parent)
+        # Render at the refresh rate of the screen, but not faster than max_fps
+        screen = QtGui.QGuiApplication.primaryScreen()
+        refresh_rate = screen.refreshRate() if screen is not None else 60.
+        fps = min(refresh_rate, max_fps) if max_fps else refresh_rate
+        self.period = 1/fps
+        self._next_tick = 0.
+        self._lock = threading.Lock()
+        self._renderers = {}
+        self._names = {}
+        self._pending = {}
+        self.stats = {}
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setTimerType(QtCore.Qt.PreciseTimer)
+        self.timer.timeout.connect(self.render)
+
+    def register(self, key, render: Callable, name: str = None):
+        """ render is called with the newest frame for key on the next tick """
+        self._renderers[key] = render
+        self.stats[key] = RenderStats()
+        self._names[key] = name or type(key).__name__
+
+    def submit(self, key, frame):
+        """ Keep frame as the next one to render for key, replacing one that was not rendered yet """
+        with self._lock:
+            stats = self.stats[key]
+            stats.received += 1
+            if key in self._pending:
+                stats.skipped += 1
+            self._pending[key] = frame
+        # Called from the GUI thread, as the slots that get the frames are
+        if not self.timer.isActive():
+            self._schedule()
+
+    def _schedule(self):
+        now = time.perf_counter()
+        if self._next_tick < now - self.period:
+            # Idle for more than a tick, render right away and don't catch up on missed ticks
+            self._next_tick = now
+        self.timer.start(max(int((self._next_tick - now)*1000), 0))
+
+    def render(self):
+        self._next_tick += self.period
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            # Nothing came in since the last tick, wake up again with the next frame
+            return
+        # Frames that come in while rendering wait for the next tick
+        self._schedule()
+        for key, frame in pending.items():
+            try:
+                self._renderers[key](frame)
+            except Exception as error:
+                log.warning("Rendering %s failed: %s", self._names[key], error)
+                continue
+            self.stats[key].rendered += 1
+
+    def log_stats(self):
+        for key, stats in self.stats.items():
+            log.info("%s: %s frames received, %s rendered, %s skipped", self._names[key],
+                     stats.received, stats.rendered, stats.skipped)
+
+    def stop(self):
+        self.timer.stop()
+        self.log_stats()
@@ -0,0 +1,199 @@
+""" Sparse map of the exposure of a sample that can grow in every direction. The map is cut into
+square tiles that are only allocated where the stage has been. For zoomed out views there are
+downsampled levels, level n has one pixel for 2**n x 2**n scene units, they are updated together
+with the full resolution tiles, so drawing never has to reduce the full resolution data. With a
+HistoryStore the tiles are loaded from disk when they are first needed and written back by flush."""
+
+import math
+from typing import Tuple
+
+import numpy as np
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+TILE = 256
+LEVELS = 6
+
+
+def gray_lut() -> np.ndarray:
+    """ 256 opaque gray levels as 0xAARRGGBB """
+    levels = np.arange(256, dtype=np.uint32)
+    return 0xFF000000 | (levels << 16) | (levels << 8) | levels
+
+
+def to_colors(exposure: np.ndarray, lut: np.ndarray) -> np.ndarray:
+    """ Each unit of exposure blends a 1/255 of white over the last color, like a painter drawing
+    with alpha 1 would."""
+    levels = 255*(1 - np.exp(-exposure/255))
+    return lut[levels.astype(np.uint8)]
+
+
+class TiledMap:
+    """ The exposure per scene unit, stored in tiles of TILE x TILE with LEVELS levels of detail """
+
+    def __init__(self, tile: int = TILE, levels: int = LEVELS, store=None):
+        self.tile = tile
+        self.levels = levels
+        # One dict per level, from the tile index (column, row) to the array of the tile
+        self.tiles = [{} for _ in range(levels)]
+        self.store = store
+        # Tiles that changed since the last flush as (level, key)
+        self.dirty = set()
+
+    def add(self, rect: Tuple[int, int, int, int], amount: float) -> set:
+        """ Add exposure in rect (x, y, width, height) in scene units. Returns the tiles that
+        changed on all levels as (level, (column, row))."""
+        x, y, width, height = rect
+        if width <= 0 or height <= 0:
+            return set()
+        dirty = set()
+        for key, region in self._regions(0, x, y, width, height, create=True):
+            self.tiles[0][key][region] += amount
+            dirty.add((0, key))
+        for level in range(1, self.levels):
+            # The rectangle on this level, grown to whole pixels
+            x0, y0 = x >> level, y >> level
+            x1, y1 = -(-(x + width) >> level), -(-(y + height) >> level)
+            finer = self.read(level - 1, 2*x0, 2*y0, 2*(x1 - x0), 2*(y1 - y0))
+            coarse = finer.reshape(y1 - y0, 2, x1 - x0, 2).mean(axis=(1, 3))
+            for key, region in self._regions(level, x0, y0, x1 - x0, y1 - y0, create=True):
+                column, row = key
+                self.tiles[level][key][region] = coarse[
+                    row*self.tile + region[0].start - y0:row*self.tile + region[0].stop - y0,
+                    column*self.tile + region[1].start - x0:column*self.tile + region[1].stop - x0]
+                dirty.add((level, key))
+        self.dirty |= dirty
+        return dirty
+
+    def read(self, level: int, x: int, y: int, width: int, height: int) -> np.ndarray:
+        """ Exposure in a rectangle of pixels of level, zero where nothing was allocated """
+        out = np.zeros((height, width), dtype=np.float32)
+        for key, region in self._regions(level, x, y, width, height):
+            column, row = key
+            out[row*self.tile + region[0].start - y:row*self.tile + region[0].stop - y,
+                column*self.tile + region[1].start - x:column*self.tile + region[1].stop - x] = \
+                self.tiles[level][key][region]
+        return out
+
+    def get_tile(self, level: int, key: Tuple[int, int]) -> np.ndarray:
+        tile = self.tiles[level].get(key)
+        if tile is None and self.store is not None:
+            tile = self.store.get_tile(level, key)
+            if tile is not None:
+                self.tiles[level][key] = tile
+        return tile
+
+    def flush(self):
+        """ Write the tiles that changed to the store """
+        if self.store is not None and self.dirty:
+            self.store.write_tiles({(level, key): self.tiles[level][key]
+                                    for level, key in self.dirty})
+        self.dirty = set()
+
+    def extent(self) -> Tuple[int, int, int, int]:
+        """ Rectangle in scene units that holds all allocated tiles """
+        keys = set(self.tiles[0])
+        if self.store is not None:
+            keys.update(self.store.keys(0))
+        if not keys:
+            return (0, 0, 0, 0)
+        keys = np.array(list(keys))
+        x0, y0 = keys.min(axis=0)*self.tile
+        x1, y1 = (keys.max(axis=0) + 1)*self.tile
+        return (int(x0), int(y0), int(x1 - x0), int(y1 - y0))
+
+    def nbytes(self) -> int:
+        return sum(tile.nbytes for level in self.tiles for tile in level.values())
+
+    def clear(self, store=None):
+        """ Start an empty map, optionally stored in another store """
+        self.tiles = [{} for _ in range(self.levels)]
+        self.dirty = set()
+        self.store = store
+
+    def _regions(self, level: int, x: int, y: int, width: int, height: int, create=False):
+        """ The tiles that overlap the rectangle and the slices of the overlap in each tile """
+        for row in range(y//self.tile, (y + height - 1)//self.tile + 1):
+            for column in range(x//self.tile, (x + width - 1)//self.tile + 1):
+                key = (column, row)
+                if self.get_tile(level, key) is None:
+                    if not create:
+                        continue
+                    self.tiles[level][key] = np.zeros((self.tile, self.tile), dtype=np.float32)
+                origin_x, origin_y = column*self.tile, row*self.tile
+                yield key, np.s_[max(y, origin_y) - origin_y:
+                                 min(y + height, origin_y + self.tile) - origin_y,
+                                 max(x, origin_x) - origin_x:
+                                 min(x + width, origin_x + self.tile) - origin_x]
+
+
+class TiledMapItem(QtWidgets.QGraphicsItem):
+    """ Draws a TiledMap. The level is picked from the zoom of the view, only tiles in the exposed
+    rectangle are drawn. The colors of each tile are cached as a QImage until the tile changes."""
+
+    def __init__(self, tiled_map: TiledMap = None, lut: np.ndarray = None, scale: float = 1.,
+                 parent=None):
+        super().__init__(parent)
+        self.map = TiledMap() if tiled_map is None else tiled_map
+        self.lut = gray_lut() if lut is None else lut
+        # Units of exposure per value of the map
+        self.scale = scale
+        # (level, key) -> (colors, QImage), the QImage shares the memory of the colors
+        self._images = {}
+        self._extent = QtCore.QRectF(*self.map.extent())
+        self.setFlag(QtWidgets.QGraphicsItem.GraphicsItemFlag.ItemUsesExtendedStyleOption)
+
+    def boundingRect(self):
+        return self._extent
+
+    def add(self, rect: QtCore.QRectF, amount: float):
+        """ Add exposure in rect and repaint only that part """
+        rect = rect.toRect()
+        for dirty in self.map.add((rect.x(), rect.y(), rect.width(), rect.height()), amount):
+            self._images.pop(dirty, None)
+        extent = QtCore.QRectF(*self.map.extent())
+        if not self._extent.contains(extent):
+            self.prepareGeometryChange()
+            self._extent = extent
+        self.update(QtCore.QRectF(rect))
+
+    def level_for(self, painter: QtGui.QPainter) -> int:
+        """ Coarsest level that still has at least one pixel per pixel on the screen """
+        scale = QtWidgets.QStyleOptionGraphicsItem.levelOfDetailFromTransform(
+            painter.worldTransform())
+        if scale <= 0:
+            return 0
+        return int(min(max(math.floor(-math.log2(scale)), 0), self.map.levels - 1))
+
+    def paint(self, painter, option, widget=None):
+        level = self.level_for(painter)
+        size = self.map.tile << level
+        exposed = option.exposedRect
+        for row in range(math.floor(exposed.top()/size), math.floor(exposed.bottom()/size) + 1):
+            for column in range(math.floor(exposed.left()/size),
+                                math.floor(exposed.right()/size) + 1):
+                image = self.image(level, (column, row))
+                if image is not None:
+                    painter.drawImage(QtCore.QRectF(column*size, row*size, size, size), image)
+
+    def image(self, level: int, key: Tuple[int, int]):
+        if (level, key) not in self._images:
+            tile = self.map.get_tile(level, key)
+            if tile is None:
+                return None
+            colors = to_colors(tile*self.scale, self.lut)
+            image = QtGui.QImage(colors.data, self.map.tile, self.map.tile, self.map.tile*4,
+                                 QtGui.QImage.Format.Format_RGB32)
+            self._images[(level, key)] = (colors, image)
+        return self._images[(level, key)][1]
+
+    def set_lut(self, lut: np.ndarray):
+        self.lut = lut
+        self._images.clear()
+        self.update()
+
+    def clear(self, store=None):
+        self.map.clear(store)
+        self._images.clear()
+        self.prepareGeometryChange()
+        self._extent = QtCore.QRectF()
+        self.update()
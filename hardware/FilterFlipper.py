@@ -8,6 +8,7 @@ import Thorlabs.MotionControl.DeviceManagerCLI as DeviceManagerCLI
 # import Thorlabs.MotionControl.GenericMotorCLI as GenericMotorCLI
 import Thorlabs.MotionControl.FilterFlipperCLI as FilterFlipperCLI
 from System import UInt32, Int32
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
 
 
 class FilterFlipper(object):
@@ -71,16 +72,30 @@ class Flippers():
         DeviceManagerCLI.DeviceManagerCLI.BuildDeviceList()
         availableDevices = DeviceManagerCLI.DeviceManagerCLI.GetDeviceList()
         self.flippers = [FilterFlipper() for i in range(len(availableDevices))]
-        for idx, flipper in enumerate(self.flippers):
-            flipper.connect(idx)
-
-    def brightfield(self, on:bool = True):
+        # One worker for each flipper, so all of them move at the same time, but the moves of one
+        # flipper run one after the other
+        self.executors = [ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"flipper{idx}")
+                          for idx in range(len(self.flippers))]
+        for future in wait_futures([executor.submit(flipper.connect, idx)
+                                    for idx, (flipper, executor)
+                                    in enumerate(zip(self.flippers, self.executors))]).done:
+            future.result()
+
+    def brightfield(self, on:bool = True, wait:bool = True):
+        """ Move all flippers at once. Returns the futures of the moves, with wait they are done
+        when this returns, taking as long as the slowest flipper."""
+        futures = [executor.submit(flipper.moveUp if on else flipper.moveDown)
+                   for flipper, executor in zip(self.flippers, self.executors)]
+        if wait:
+            for future in wait_futures(futures).done:
+                future.result()
+        return futures
+
+    def close(self):
+        for executor in self.executors:
+            executor.shutdown(wait=True)
         for flipper in self.flippers:
-            if on:
-                print("MOVE flipper up")
-                flipper.moveUp()
-            else:
-                flipper.moveDown()
+            flipper.disconnect()
 
 
 def brightfield(on:bool = True):
@@ -0,0 +1,9 @@
+""" Devices that are controlled from Python directly, not through Micro-Manager. The modules import
+their drivers when they are loaded, so they are only imported where they are used."""
+
+
+def connect_flippers():
+    """ Connect all filter flippers. Importing FilterFlipper loads pythonnet and the Kinesis dlls,
+    this can be called on a background thread, before anything else of the hardware is loaded."""
+    from hardware.FilterFlipper import Flippers
+    return Flippers()
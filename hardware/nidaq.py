@@ -1,33 +1,42 @@
 from PyQt5.QtCore import QObject, pyqtSignal, pyqtSlot
 from MicroManagerControl import MicroManagerControl
-from data_structures import MMSettings
+from data_structures import (MMSettings, SettingsSnapshot, ChannelSnapshot, Impact,
+                             diff_settings)
 import nidaqmx
 import nidaqmx.stream_writers
 import numpy as np
-import copy
 
 import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from event_threadQ import EventThread
 from gui.GUIWidgets import SettingsView
-from hardware.FilterFlipper import Flippers
+from logger import get_logger
+from dose import dose_rate
+from hardware import connect_flippers
+
+log = get_logger("nidaq")
 
 
 class NIDAQ(QObject):
 
-    new_ni_settings = pyqtSignal(MMSettings)
+    new_ni_settings = pyqtSignal(SettingsSnapshot)
+    # Light dose per second of what is running, see dose.py
+    dose_rate_event = pyqtSignal(float)
 
-    def __init__(self, event_thread: EventThread, mm_interface: MicroManagerControl):
+    def __init__(self, event_thread: EventThread, mm_interface: MicroManagerControl,
+                 flippers: Future = None):
         super().__init__()
         self.event_thread = event_thread
         self.core = self.event_thread.bridge.get_core()
+        self.device_state = self.event_thread.device_state
         self.mm_interface = mm_interface
 
         #Get the EDA setting to only do things when EDA is off, otherwise the daq_actuator is active
-        eda = self.core.get_property('EDA', "Label")
+        eda = self.device_state.get_property('EDA', "Label")
         self.eda = False if eda == "Off" else True
 
         settings = self.event_thread.bridge.get_studio().acquisitions().get_acquisition_settings()
-        self.settings = MMSettings(settings)
+        self.settings = MMSettings(settings, bridge=self.event_thread.bridge).snapshot()
 
         self.system = nidaqmx.system.System.local()
 
@@ -38,7 +47,7 @@ class NIDAQ(QObject):
         self.stage = Stage(self)
         self.camera = Camera(self)
         self.aotf = AOTF(self)
-        self.brightfield_control = Brightfield(self)
+        self.brightfield_control = Brightfield(self, flippers)
 
         self.acq = Acquisition(self, self.settings)
         self.live = LiveMode(self)
@@ -58,7 +67,7 @@ class NIDAQ(QObject):
 
     def init_task(self):
         try: self.task.close()
-        except: print("Task close failed")
+        except: log.debug("Task close failed")
         self.task = nidaqmx.Task()
         self.task.ao_channels.add_ao_voltage_chan('Dev1/ao0') # galvo channel
         self.task.ao_channels.add_ao_voltage_chan('Dev1/ao1') # z stage
@@ -69,7 +78,7 @@ class NIDAQ(QObject):
 
     def update_settings(self, new_settings):
         try:
-            self.cycle_time = new_settings.channels['488']['exposure']
+            self.cycle_time = new_settings.channel('488').exposure
         except KeyError:
             self.cycle_time = 100
 
@@ -80,60 +89,77 @@ class NIDAQ(QObject):
         #settings for all pulses:
         self.duty_cycle = 10/self.n_points
         self.settings = new_settings
-        print('NI settings set')
+        log.debug("NI settings set")
 
-    @pyqtSlot(MMSettings)
-    def new_settings(self, new_settings: MMSettings):
+    @pyqtSlot(SettingsSnapshot)
+    def new_settings(self, new_settings: SettingsSnapshot):
+        self.event_thread.metrics.slot_entry("mda_settings_event")
+        diff = diff_settings(self.settings, new_settings)
+        log.info("New settings: %s %s", diff.impact.name, diff.changed)
         self.settings = new_settings
-        self.update_settings(new_settings)
-        self.acq.update_settings(new_settings)
-        self.live.update_settings(new_settings)
-        print('NEW SETTINGS SET')
+        if diff.impact == Impact.FULL:
+            self.update_settings(new_settings)
+        self.acq.update_settings(new_settings, diff.impact)
+        if diff.impact == Impact.FULL:
+            # Live mode does not depend on the interval, slices or the channels of the MDA
+            self.live.update_settings(new_settings)
 
     @pyqtSlot(str, str, str)
     def power_settings(self, device, prop, value):
+        self.event_thread.metrics.slot_entry("settings_event", "power_settings")
         if device == "488_AOTF" and prop == r"Power (% of max)":
             self.aotf.power_488 = float(value)
         elif device == "561_AOTF" and prop == r"Power (% of max)":
             self.aotf.power_561 = float(value)
         elif device == "exposure":
-            self.settings.channels['488']['exposure'] = float(value)
-            self.update_settings(self.settings)
+            self.update_settings(self.settings.with_channel('488', exposure=float(value)))
         elif device == 'PrimeB_Camera' and prop == "TriggerMode":
-            print(value)
+            log.info("Trigger mode %s", value)
             brightfield = True if value == "Internal Trigger" else False
             self.brightfield_control.toggle_flippers(brightfield)
         elif device == "EDA" and prop == "Label":
-            eda = self.core.get_property('EDA', "Label")
+            eda = self.device_state.get_property('EDA', "Label")
             self.eda = False if eda == "Off" else True
             # Close the task if EDA is going to take over
             if self.eda:
                 try:
                     self.task.close()
                 except AttributeError:
-                    print("No task defined yet.")
+                    log.info("No task defined yet.")
                 self.event_thread.acquisition_started_event.disconnect(self.run_acquisition_task)
                 self.event_thread.acquisition_ended_event.disconnect(self.acq_done)
                 self.event_thread.mda_settings_event.disconnect(self.new_settings)
             else:
                 self.update_settings(self.settings)
+                for signal in ["acquisition_started_event", "acquisition_ended_event",
+                               "mda_settings_event"]:
+                    self.event_thread.metrics.drop_pending(signal)
                 self.event_thread.acquisition_started_event.connect(self.run_acquisition_task)
                 self.event_thread.acquisition_ended_event.connect(self.acq_done)
                 self.event_thread.mda_settings_event.connect(self.new_settings)
 
         if device in ["561_AOTF", "488_AOTF", 'exposure']:
             self.live.make_daq_data()
+            if self.live.is_on and not self.live.brightfield:
+                self.dose_rate_event.emit(dose_rate(self.live.daq_data))
+            # The powers are part of the acquisition data, rebuild it before the next run
+            self.acq.ready = False
 
 
     @pyqtSlot(object)
     def run_acquisition_task(self, _):
+        self.event_thread.metrics.slot_entry("acquisition_started_event")
         if not self.eda:
             self.event_thread.mda_settings_event.disconnect(self.new_settings)
             time.sleep(0.5)
             self.acq.run_acquisition()
+            self.dose_rate_event.emit(dose_rate(self.acq.daq_data))
 
     @pyqtSlot(object)
     def acq_done(self, _):
+        self.event_thread.metrics.slot_entry("acquisition_ended_event")
+        self.dose_rate_event.emit(0.)
+        self.event_thread.metrics.drop_pending("mda_settings_event")
         self.event_thread.mda_settings_event.connect(self.new_settings)
         self.acq.set_z_position.emit(self.acq.orig_z_position)
         self.event_thread.mda_settings_event.connect(self.new_settings)
@@ -144,24 +170,23 @@ class NIDAQ(QObject):
 
     @pyqtSlot(bool)
     def start_live(self, live_is_on):
+        self.event_thread.metrics.slot_entry("live_mode_event")
         self.live.toggle(live_is_on)
 
     def generate_one_timepoint(self, live_channel: int = None, z_inverse: bool = False):
         if live_channel == "LED":
             timepoint = np.ndarray((6,1))
             return timepoint
-        print("one timepoint post_delay", self.settings.post_delay)
+        log.debug("one timepoint post_delay %s", self.settings.post_delay)
 
         if not self.settings.use_channels or live_channel is not None:
-            old_post_delay = self.settings.post_delay
-            self.settings.post_delay = 0.03
-            galvo = self.galvo.one_frame(self.settings)
-            camera = self.camera.one_frame(self.settings)
+            settings = self.settings.replace(post_delay=0.03)
+            galvo = self.galvo.one_frame(settings)
+            camera = self.camera.one_frame(settings)
             channel_name = '488' if live_channel is None else live_channel
-            stage = self.stage.one_frame(self.settings, 0)
-            aotf = self.aotf.one_frame(self.settings, self.settings.channels[channel_name])
+            stage = self.stage.one_frame(settings, 0)
+            aotf = self.aotf.one_frame(settings, settings.channel(channel_name))
             timepoint = np.vstack((galvo, stage, camera, aotf))
-            self.settings.post_delay = old_post_delay
         else:
             galvo = self.galvo.one_frame(self.settings)
             camera = self.camera.one_frame(self.settings)
@@ -172,10 +197,8 @@ class NIDAQ(QObject):
         return timepoint
 
     def get_slices(self):
-        iter_slices = copy.deepcopy(self.settings.slices)
-        iter_slices_rev = copy.deepcopy(iter_slices)
-        iter_slices_rev.reverse()
-        return iter_slices, iter_slices_rev
+        # The slices are a tuple in the snapshot, no need to copy them
+        return self.settings.slices, self.settings.slices[::-1]
 
     def channels_then_slices(self, galvo, camera, z_inverse):
         iter_slices, iter_slices_rev = self.get_slices()
@@ -184,8 +207,8 @@ class NIDAQ(QObject):
         slices = iter_slices if not z_inverse else iter_slices_rev
         for sli in slices:
             channels_data = []
-            for channel in self.settings.channels.values():
-                if channel['use']:
+            for channel in self.settings.channels:
+                if channel.use:
                     aotf = self.aotf.one_frame(self.settings, channel)
                     offset = sli - self.settings.slices[0]
                     stage = self.stage.one_frame(self.settings, offset)
@@ -199,8 +222,8 @@ class NIDAQ(QObject):
         iter_slices, iter_slices_rev = self.get_slices()
         z_iter = 0
         channels_data = []
-        for channel in self.settings.channels.values():
-            if channel['use']:
+        for channel in self.settings.channels:
+            if channel.use:
                 slices_data = []
                 slices = iter_slices if not np.mod(z_iter, 2) else iter_slices_rev
                 for sli in slices:
@@ -218,13 +241,13 @@ class LiveMode(QObject):
     def __init__(self, ni:NIDAQ):
         super().__init__()
         self.ni = ni
-        core = self.ni.event_thread.bridge.get_core()
-        self.channel_name= core.get_property('DPseudoChannel', "Label")
+        self.channel_name = self.ni.device_state.get_property('DPseudoChannel', "Label")
         self.ready = self.make_daq_data()
         self.stop = False
-        self.brightfield = core.get_property('PrimeB_Camera', "TriggerMode")
+        self.is_on = False
+        self.brightfield = self.ni.device_state.get_property('PrimeB_Camera', "TriggerMode")
         self.brightfield = (self.brightfield == "Internal Trigger")
-        self.ni.brightfield_control.flippers.brightfield(self.brightfield)
+        self.ni.brightfield_control.toggle_flippers(self.brightfield)
 
     @pyqtSlot(str, str, str)
     def channel_setting(self, device, prop, value):
@@ -258,14 +281,14 @@ class LiveMode(QObject):
         try:
             timepoint = self.ni.generate_one_timepoint(live_channel = self.channel_name)
         except KeyError:
-            print("WARNING: are there channels in the MDA window?")
+            log.warning("Are there channels in the MDA window?")
             return False
         no_frames = np.max([1, round(200/self.ni.cycle_time)])
-        print("N Frames ", no_frames)
+        log.debug("N Frames %s", no_frames)
         self.daq_data = np.tile(timepoint, no_frames)
         self.stop_data = np.asarray(
                 [[self.ni.galvo.parking_voltage, 0, 0, 0, 0, 0]]).astype(np.float64).transpose()
-        print(self.daq_data.shape[1])
+        log.debug("Live samples %s", self.daq_data.shape[1])
         return True
 
     def send_stop_data(self):
@@ -273,57 +296,73 @@ class LiveMode(QObject):
         self.ni.task.write(self.stop_data)
 
     def toggle(self, live_is_on):
-
+        self.is_on = live_is_on
         if self.brightfield:
             self.ni.brightfield_control.led(live_is_on, 0.3)
             return
 
         if live_is_on:
             if not self.ready:
-                core = self.ni.event_thread.bridge.get_core()
-                self.channel_name = core.get_property('DPseudoChannel', "Label")
+                self.channel_name = self.ni.device_state.get_property('DPseudoChannel', "Label")
                 self.ready = self.make_daq_data()
             self.stop = False
             self.update_settings(self.ni.settings)
             self.ni.task.start()
-            print("STARTED", time.perf_counter())
+            self.ni.dose_rate_event.emit(dose_rate(self.daq_data))
+            log.debug("Live started %s", time.perf_counter())
         else:
             self.stop = True
+            self.ni.dose_rate_event.emit(0.)
 
 
 class Acquisition(QObject):
     set_z_position = pyqtSignal(float)
-    def __init__(self, ni:NIDAQ, settings: MMSettings):
+    def __init__(self, ni:NIDAQ, settings: SettingsSnapshot):
         super().__init__()
         self.settings = settings
         self.ni = ni
         self.daq_data = None
         self.ready = self.make_daq_data()
 
-    def update_settings(self, new_settings):
-        self.ready = False
+    def update_settings(self, new_settings, impact: Impact = Impact.FULL):
+        """ Rebuild only what the change of the settings requires, see diff_settings """
         self.settings = new_settings
-        self.make_daq_data()
+        if impact == Impact.NONE and self.ready:
+            return
+        if impact == Impact.INTERVAL and self.ready:
+            self.ready = self.tile_timepoints()
+        else:
+            self.ready = self.make_daq_data()
+
+    def prepare_task(self):
+        """ Set up the task for the acquisition, live mode uses the same task """
+        if not self.ready:
+            self.ready = self.make_daq_data()
         self.ni.init_task()
         self.ni.task.timing.cfg_samp_clk_timing(rate=self.ni.smpl_rate,
                                 sample_mode=nidaqmx.constants.AcquisitionType.FINITE,
                                 samps_per_chan=self.daq_data.shape[1])
         self.ni.stream = nidaqmx.stream_writers.AnalogMultiChannelWriter(self.ni.task.out_stream,
                                                                          auto_start=False)
-        print('Stream length ', self.daq_data.shape[1])
-        self.ready = True
+        log.debug("Stream length %s", self.daq_data.shape[1])
 
     def make_daq_data(self):
         try:
-            timepoint = self.ni.generate_one_timepoint()
+            self.timepoint = self.ni.generate_one_timepoint()
         except ValueError:
-            print("WARNING: Are the channels in the MDA pannel?")
+            log.warning("Are the channels in the MDA pannel?")
             return False
-        timepoint = self.add_interval(timepoint)
         # Make zstage go up/down over two timepoints
+        self.timepoint_inverse = None
         if self.settings.acq_order_mode == 0:
-            timepoint_inverse = self.ni.generate_one_timepoint(z_inverse=True)
-            timepoint_inverse = self.add_interval(timepoint_inverse)
+            self.timepoint_inverse = self.ni.generate_one_timepoint(z_inverse=True)
+        return self.tile_timepoints()
+
+    def tile_timepoints(self):
+        """ Add the interval to the timepoints and repeat them for all timepoints """
+        timepoint = self.add_interval(self.timepoint)
+        if self.timepoint_inverse is not None:
+            timepoint_inverse = self.add_interval(self.timepoint_inverse)
             double_timepoint = np.hstack([timepoint, timepoint_inverse])
             self.daq_data = np.tile(double_timepoint, int(np.floor(self.settings.timepoints/2)))
             if self.settings.timepoints % 2 == 1:
@@ -335,8 +374,8 @@ class Acquisition(QObject):
     def add_interval(self, timepoint):
         if (self.ni.smpl_rate*self.settings.interval_ms/1000 <= timepoint.shape[1] and
             self.settings.interval_ms > 0):
-            print('Error: interval time shorter than time required to acquire single timepoint.')
-            self.settings.interval_ms = 0
+            log.error("Interval time shorter than time required to acquire single timepoint.")
+            self.settings = self.settings.replace(interval_ms=0)
 
         if self.settings.interval_ms > 0:
             missing_samples = round(self.ni.smpl_rate * self.settings.interval_ms/1000-timepoint.shape[1])
@@ -344,20 +383,20 @@ class Acquisition(QObject):
             rest = np.zeros((timepoint.shape[0] - 1, missing_samples))
             delay = np.vstack([galvo, rest])
             timepoint = np.hstack([timepoint, delay])
-        print("INTERVAL: ", self.settings.interval_ms)
+        log.debug("Interval %s", self.settings.interval_ms)
         return timepoint
 
     def run_acquisition(self):
-        self.update_settings(self.settings)
+        self.prepare_task()
         self.orig_z_position = self.ni.core.get_position()
         if self.settings.use_slices:
             self.set_z_position.emit(self.settings.slices[0])
             time.sleep(0.1)
-        print("WRITING, ", self.daq_data.shape)
+        log.debug("Writing %s", self.daq_data.shape)
         written = self.ni.stream.write_many_sample(self.daq_data, timeout=20)
         time.sleep(0.5)
         self.ni.task.start()
-        print('================== Data written        ', written)
+        log.info("Data written %s", written)
 
 
 def make_pulse(ni, start, end, offset):
@@ -456,26 +495,25 @@ class AOTF:
     def __init__(self, ni:NIDAQ):
         self.ni = ni
         self.blank_voltage = 10
-        core = self.ni.event_thread.bridge.get_core()
-        self.power_488 = float(core.get_property('488_AOTF',r"Power (% of max)"))
-        self.power_561 = float(core.get_property('561_AOTF',r"Power (% of max)"))
+        self.power_488 = float(self.ni.device_state.get_property('488_AOTF',r"Power (% of max)"))
+        self.power_561 = float(self.ni.device_state.get_property('561_AOTF',r"Power (% of max)"))
 
-    def one_frame(self, settings:MMSettings, channel:dict):
+    def one_frame(self, settings: SettingsSnapshot, channel: ChannelSnapshot):
         blank = make_pulse(self.ni, 0, self.blank_voltage, 0)
-        if channel['name'] == '488':
+        if channel.name == '488':
             aotf_488 = make_pulse(self.ni, 0, self.power_488/10, 0)
             aotf_561 = make_pulse(self.ni, 0, 0, 0)
-        elif channel['name'] == '561':
+        elif channel.name == '561':
             aotf_488 = make_pulse(self.ni, 0, 0, 0)
             aotf_561 = make_pulse(self.ni, 0, self.power_561/10, 0)
-        elif channel['name'] == 'LED':
+        elif channel.name == 'LED':
             aotf_488 = make_pulse(self.ni, 0, 0, 0)
             aotf_561 = make_pulse(self.ni, 0, 0, 0)
         aotf = np.vstack((blank, aotf_488, aotf_561))
         aotf = self.add_delays(aotf, settings)
         return aotf
 
-    def add_delays(self, frame:np.ndarray, settings: MMSettings):
+    def add_delays(self, frame:np.ndarray, settings: SettingsSnapshot):
         if settings.post_delay > 0:
             delay = np.zeros((frame.shape[0], round(self.ni.smpl_rate * settings.post_delay)))
             frame = np.hstack([frame, delay])
@@ -488,26 +526,57 @@ class AOTF:
 
 
 class Brightfield:
-    def __init__(self, ni:NIDAQ):
-        self.flippers = Flippers()
+    def __init__(self, ni:NIDAQ, flippers: Future = None):
+        """ flippers is the future of the Flippers that are connected in the background """
+        if flippers is None:
+            executor = ThreadPoolExecutor(max_workers=1)
+            flippers = executor.submit(connect_flippers)
+            executor.shutdown(wait=False)
+        self._flippers = flippers
         self.led_on = False
         self.flippers_up = False
         self.ni = ni
         self.led(False)
-        self.flippers.brightfield(False)
+        self._flippers.add_done_callback(self._flippers_connected)
+
+    @property
+    def flippers(self):
+        """ Waits for the flippers if they are still connecting """
+        return self._flippers.result()
+
+    def _flippers_connected(self, future: Future):
+        if future.exception() is not None:
+            log.error("Could not connect the flippers: %s", future.exception())
+            return
+        self.toggle_flippers(self.flippers_up)
 
     def toggle_led(self):
         self.led(not self.led_on)
-        self.led_on = not self.led_on
 
     def toggle_flippers(self, up:bool = None):
+        """ Called from Qt slots, so the flippers move in the background """
         up = not self.flippers_up if up is None else up
-        self.flippers.brightfield(up)
         self.flippers_up = up
+        # If they are still connecting, _flippers_connected moves them into place
+        if not self._flippers.done() or self._flippers.exception() is not None:
+            return
+        if not self.ni.device_state.update('Flippers', 'Up', up):
+            log.debug("Flippers already %s", "up" if up else "down")
+            return
+        for future in self.flippers.brightfield(up, wait=False):
+            future.add_done_callback(self._flipper_moved)
+
+    def _flipper_moved(self, future: Future):
+        if future.exception() is not None:
+            log.error("Flipper did not move: %s", future.exception())
+            # Don't know where they are now, move them again next time
+            self.ni.device_state.invalidate('Flippers')
 
     def led(self, on:bool = True, power: float = 1.):
         self.led_on = on
         power = power if on else 0
+        if not self.ni.device_state.update('LED', 'Power', power):
+            return
         with nidaqmx.Task() as task:
             task.ao_channels.add_ao_voltage_chan("Dev1/ao6")
             task.write(power, auto_start=True)
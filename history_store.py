@@ -0,0 +1,173 @@
+""" Storage of the PositionHistory of one sample on disk, so that the map can be opened again
+later, e.g. on the next day for the same dish. Each sample is a directory with:
+
+    tiles.pack  The tiles of the TiledMap, appended as they change. Each record is a header with
+                the level, column, row and length (<biiI) and the zlib compressed float32 tile.
+                The last record of a tile is the valid one, the older ones are dropped by compact
+                when the file is opened or closed.
+    log.bin     Where the stage was, as LOG_DTYPE records: until time t (unix time) the field of
+                view was at x, y and collected dose there.
+    meta.json   The stage offset of the sample.
+
+Opening a sample only reads the tile headers, tiles are decompressed when they are drawn."""
+
+import json
+import mmap
+import os
+import struct
+import time
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+from logger import get_logger
+
+log = get_logger("gui")
+
+MAGIC = b'ISIMTILES1\n'
+_HEADER = struct.Struct('<biiI')
+LOG_DTYPE = np.dtype([('t', '<f8'), ('x', '<f4'), ('y', '<f4'), ('dose', '<f4')])
+DEFAULT_PATH = Path.home() / "isim_history"
+# tiles.pack is rewritten when it is more than this times the size of the valid records
+COMPACT_RATIO = 2
+
+
+class HistoryStore:
+    def __init__(self, path, tile: int = 256):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.tile = tile
+        self.tiles_path = self.path / "tiles.pack"
+        self.log_path = self.path / "log.bin"
+        self.meta_path = self.path / "meta.json"
+        if not self.tiles_path.exists():
+            self.tiles_path.write_bytes(MAGIC)
+        # (level, (column, row)) -> (offset, length) of the compressed data in tiles.pack
+        self.index = {}
+        self._mmap = None
+        self._scan()
+        self.compact()
+        self._tiles_file = open(self.tiles_path, 'ab')
+        self._log_file = open(self.log_path, 'ab')
+        self._log = []
+
+    @classmethod
+    def latest(cls, root=DEFAULT_PATH) -> 'HistoryStore':
+        """ Open the last sample in root, or start the first one """
+        root = Path(root)
+        samples = sorted(root.iterdir()) if root.exists() else []
+        samples = [sample for sample in samples if sample.is_dir()]
+        return cls(samples[-1]) if samples else cls.new(root)
+
+    @classmethod
+    def new(cls, root=DEFAULT_PATH) -> 'HistoryStore':
+        return cls(Path(root) / time.strftime("%Y%m%d_%H%M%S"))
+
+    def _scan(self):
+        """ Build the index from the headers, the tile data is skipped """
+        size = self.tiles_path.stat().st_size
+        with open(self.tiles_path, 'rb') as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{self.tiles_path} is not a tile pack")
+            offset = len(MAGIC)
+            while offset + _HEADER.size <= size:
+                level, column, row, length = _HEADER.unpack(file.read(_HEADER.size))
+                if offset + _HEADER.size + length > size:
+                    break
+                self.index[(level, (column, row))] = (offset + _HEADER.size, length)
+                offset += _HEADER.size + length
+                file.seek(offset)
+        if offset < size:
+            # The last write was cut off, e.g. the program crashed, new tiles go after the last one
+            log.warning("Removing incomplete tile at the end of %s", self.tiles_path)
+            os.truncate(self.tiles_path, offset)
+
+    def compact(self, ratio: float = COMPACT_RATIO):
+        """ Rewrite tiles.pack with only the last record of each tile, if the old records take up
+        more than ratio allows. Only while the pack is not open for appending."""
+        valid = sum(_HEADER.size + length for _, length in self.index.values())
+        size = self.tiles_path.stat().st_size - len(MAGIC)
+        if size <= ratio*valid:
+            return
+        temporary = self.tiles_path.with_suffix('.tmp')
+        index = {}
+        with open(self.tiles_path, 'rb') as source, open(temporary, 'wb') as target:
+            target.write(MAGIC)
+            for (level, key), (offset, length) in sorted(self.index.items(),
+                                                         key=lambda item: item[1][0]):
+                source.seek(offset)
+                target.write(_HEADER.pack(level, key[0], key[1], length))
+                index[(level, key)] = (target.tell(), length)
+                target.write(source.read(length))
+        os.replace(temporary, self.tiles_path)
+        self.index = index
+        log.info("Compacted %s from %s to %s bytes", self.tiles_path, size + len(MAGIC),
+                 valid + len(MAGIC))
+
+    def _view(self):
+        """ Memory map of the pack, mapped again when the file grew """
+        size = self.tiles_path.stat().st_size
+        if self._mmap is None or len(self._mmap) < size:
+            if self._mmap is not None:
+                self._mmap.close()
+            with open(self.tiles_path, 'rb') as file:
+                self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mmap
+
+    def get_tile(self, level: int, key) -> np.ndarray:
+        """ The tile as a writable array, None if it was never stored """
+        entry = self.index.get((level, key))
+        if entry is None:
+            return None
+        offset, length = entry
+        data = zlib.decompress(self._view()[offset:offset + length])
+        return np.frombuffer(data, dtype=np.float32).reshape(self.tile, self.tile).copy()
+
+    def keys(self, level: int = 0):
+        return [key for tile_level, key in self.index if tile_level == level]
+
+    def write_tiles(self, tiles: dict):
+        """ Append tiles given as {(level, key): array} """
+        for (level, key), tile in tiles.items():
+            data = zlib.compress(np.ascontiguousarray(tile, dtype=np.float32).tobytes(), 1)
+            self._tiles_file.write(_HEADER.pack(level, key[0], key[1], len(data)))
+            offset = self._tiles_file.tell()
+            self._tiles_file.write(data)
+            self.index[(level, key)] = (offset, len(data))
+        self._tiles_file.flush()
+
+    def append_log(self, x: float, y: float, dose: float, t: float = None):
+        self._log.append((time.time() if t is None else t, x, y, dose))
+
+    def read_log(self) -> np.ndarray:
+        """ All records of log.bin, memory mapped """
+        self.flush_log()
+        if os.path.getsize(self.log_path) == 0:
+            return np.zeros(0, dtype=LOG_DTYPE)
+        return np.memmap(self.log_path, dtype=LOG_DTYPE, mode='r')
+
+    def flush_log(self):
+        if self._log:
+            self._log_file.write(np.array(self._log, dtype=LOG_DTYPE).tobytes())
+            self._log_file.flush()
+            self._log = []
+
+    @property
+    def meta(self) -> dict:
+        if self.meta_path.exists():
+            return json.loads(self.meta_path.read_text())
+        return {}
+
+    @meta.setter
+    def meta(self, meta: dict):
+        self.meta_path.write_text(json.dumps(meta))
+
+    def close(self):
+        self.flush_log()
+        self._tiles_file.close()
+        self._log_file.close()
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self.compact()
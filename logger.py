@@ -0,0 +1,165 @@
+""" Logging for the hot paths of the program. Every subsystem gets its own logger below 'isim'
+with its own level for the file and the console. By default records only go into an in-memory ring
+buffer, that keeps everything down to ring_level (INFO), so the last records before a problem can be
+dumped even if they were not written out. With ring_level=logging.DEBUG it also keeps the debug
+records of the hot paths, at the cost of building a record for each of them. A file can be added that is written from a background
+thread, so logging never blocks the event listener or the NI callbacks on console or disk I/O.
+Levels can also be set with the environment variable ISIM_LOG, e.g.
+ISIM_LOG="events=DEBUG,nidaq=INFO".
+
+In the hot paths use the lazy form log.debug("x %s", x), a disabled call returns right away and the
+arguments are only formatted when a record is written out, the ring buffer keeps them unformatted."""
+
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+from collections import deque
+
+ROOT = 'isim'
+RING_SIZE = 10_000
+FORMAT = '%(asctime)s %(levelname)-7s %(name)-14s %(message)s'
+
+DEFAULT_LEVELS = {'events': logging.WARNING,
+                  'nidaq': logging.WARNING,
+                  'mm': logging.WARNING,
+                  'gui': logging.WARNING,
+                  'startup': logging.INFO}
+
+
+class SubsystemFilter(logging.Filter):
+    """ Let records through from the level of their subsystem on """
+
+    def __init__(self, levels: dict):
+        super().__init__()
+        self.levels = levels
+
+    def filter(self, record):
+        subsystem = record.name[len(ROOT) + 1:].split('.')[0]
+        return record.levelno >= self.levels.get(subsystem, logging.WARNING)
+
+
+class RingBufferHandler(logging.Handler):
+    """ Keeps the last capacity records in memory without formatting them """
+
+    def __init__(self, capacity: int = RING_SIZE):
+        super().__init__()
+        self.records = deque(maxlen=capacity)
+
+    def emit(self, record):
+        self.records.append(record)
+
+    def lines(self):
+        formatter = logging.Formatter(FORMAT)
+        return [formatter.format(record) for record in list(self.records)]
+
+    def dump(self, path):
+        with open(path, 'w') as file:
+            file.write('\n'.join(self.lines()) + '\n')
+
+
+_ring = RingBufferHandler()
+_listener = None
+_queue_handler = None
+_configured = False
+# Levels of the records that are written out, per subsystem
+_levels = {}
+
+
+def _env_levels():
+    levels = {}
+    for entry in os.environ.get('ISIM_LOG', '').split(','):
+        if '=' in entry:
+            subsystem, level = entry.split('=', 1)
+            levels[subsystem.strip()] = level.strip().upper()
+    return levels
+
+
+def _level_number(level) -> int:
+    """ Names like 'DEBUG' are turned into their numbers to compare them with the records """
+    if isinstance(level, str):
+        number = logging.getLevelName(level.upper())
+        if not isinstance(number, int):
+            raise ValueError("Unknown log level " + level)
+        return number
+    return level
+
+
+def _stop_listener():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def configure(levels: dict = None, log_file: str = None, console: bool = False,
+              ring_level: int = logging.INFO):
+    """ Set the levels per subsystem and optionally add a file that is written asynchronously.
+    With console, records are also printed, as before this module existed. The loggers let
+    everything from ring_level on through to the ring buffer, the levels only filter what is
+    written to the file and the console."""
+    global _listener, _queue_handler, _configured
+    root = logging.getLogger(ROOT)
+    root.propagate = False
+    root.setLevel(logging.DEBUG)
+    if not _configured:
+        root.addHandler(_ring)
+        atexit.register(_stop_listener)
+        _configured = True
+
+    all_levels = dict(DEFAULT_LEVELS)
+    all_levels.update({subsystem: _level_number(level) for subsystem, level in
+                       (levels or {}).items()})
+    ignored = []
+    for subsystem, level in _env_levels().items():
+        try:
+            all_levels[subsystem] = _level_number(level)
+        except ValueError:
+            ignored.append(subsystem + '=' + level)
+    _levels.clear()
+    _levels.update(all_levels)
+    ring_level = _level_number(ring_level)
+    _ring.setLevel(ring_level)
+    for subsystem, level in _levels.items():
+        logging.getLogger(ROOT + '.' + subsystem).setLevel(min(level, ring_level))
+
+    handlers = []
+    if log_file is not None:
+        file_handler = logging.FileHandler(log_file)
+        file_handler.setFormatter(logging.Formatter(FORMAT))
+        handlers.append(file_handler)
+    if console:
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(logging.Formatter(FORMAT))
+        handlers.append(stream_handler)
+    if handlers:
+        _stop_listener()
+        root.removeHandler(_queue_handler)
+        log_queue = queue.SimpleQueue()
+        _queue_handler = logging.handlers.QueueHandler(log_queue)
+        # Filtered before the queue, records that are not written out cost no formatting
+        _queue_handler.addFilter(SubsystemFilter(_levels))
+        root.addHandler(_queue_handler)
+        _listener = logging.handlers.QueueListener(log_queue, *handlers,
+                                                   respect_handler_level=True)
+        _listener.start()
+    if ignored:
+        logging.getLogger(ROOT + '.startup').warning("Ignored unknown levels in ISIM_LOG: %s",
+                                                     ', '.join(ignored))
+
+
+def get_logger(subsystem: str) -> logging.Logger:
+    if not _configured:
+        configure()
+    return logging.getLogger(ROOT + '.' + subsystem)
+
+
+def recent(n: int = 100):
+    """ The last n records from the ring buffer as formatted lines """
+    return _ring.lines()[-n:]
+
+
+def dump(path):
+    """ Write the ring buffer to a file, e.g. after something went wrong """
+    _ring.dump(path)
@@ -1,30 +1,68 @@
-from MicroManagerControl import MicroManagerControl
-from data_structures import MMSettings
-from gui.GUIWidgets import SettingsView
 import sys
-from PyQt5 import QtWidgets
-from event_threadQ import EventThread
-from gui.MainGUI import MainGUI
-from hardware.nidaq import NIDAQ
+from concurrent.futures import ThreadPoolExecutor
+
+import logger
+from startup import StartupTimer
+# Only the package, hardware.nidaq loads nidaqmx and is imported once the GUI is up
+from hardware import connect_flippers
+# Only the function, it imports pygame in the startup thread
+from MonogramCC import open_controller
 
 
 def main():
-    app = QtWidgets.QApplication(sys.argv)
+    logger.configure(log_file="isimgui.log")
+    timer = StartupTimer()
+
+    # The flippers and the Monogram controller do not depend on anything else, start them right
+    # away, next to the event thread, the GUI and the NIDAQ
+    executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="startup")
+    flippers = executor.submit(timer.timed("flippers", connect_flippers))
+    monogram = executor.submit(timer.timed("monogram", open_controller))
+
+    with timer.phase("import qt"):
+        from PyQt5 import QtWidgets
+        app = QtWidgets.QApplication(sys.argv)
 
+    with timer.phase("event thread"):
+        from event_threadQ import EventThread
+        event_thread = EventThread()
+        event_listener = event_thread.listener
 
-    event_thread = EventThread()
-    event_listener = event_thread.listener
+    with timer.phase("main gui"):
+        from gui.MainGUI import MainGUI
+        miniapp = MainGUI(event_thread=event_listener, monogram=False, history=True)
+        miniapp.show()
+        # Draw the window before the hardware blocks the event loop
+        app.processEvents()
 
-    mm_interface = MicroManagerControl(event_listener)
+    with timer.phase("import nidaq"):
+        from gui.GUIWidgets import SettingsView
+        from hardware.nidaq import NIDAQ
 
+    with timer.phase("nidaq"):
+        # One interface to the core, with its own z mover thread, closed by the GUI
+        mm_interface = miniapp.mm_interface
+        ni = NIDAQ(event_listener, mm_interface, flippers=flippers)
+        settings_view = SettingsView(event_listener)
+        ni.dose_rate_event.connect(miniapp.position_history.set_dose_rate)
 
-    ni = NIDAQ(event_listener, mm_interface)
-    settings_view = SettingsView(event_listener)
-    miniapp = MainGUI(event_thread=event_listener)
-    miniapp.show()
+    with timer.phase("connect monogram"):
+        from MonogramCC import MonogramCC
+        try:
+            miniapp.connect_monogram(MonogramCC(monogram.result()))
+        except OSError as error:
+            logger.get_logger("startup").info("No Monogram: %s", error)
 
+    flippers.add_done_callback(lambda _: timer.report())
+    executor.shutdown(wait=False)
 
-    sys.exit(app.exec_())
+    exit_code = app.exec_()
+    try:
+        # Let the last moves finish and disconnect
+        flippers.result().close()
+    except Exception as error:
+        logger.get_logger("startup").warning("Flippers were not closed: %s", error)
+    sys.exit(exit_code)
 
 
 
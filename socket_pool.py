@@ -0,0 +1,169 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import zmq
+from pycromanager import Bridge
+
+from logger import get_logger
+
+log = get_logger("events")
+
+
+class SocketPool:
+    """ Pool of Java sockets that the event proxies are created on. Sockets are checked out while
+    an event is handled, so that two events never share a busy socket. The pool grows on demand
+    up to max_size and replaces sockets that broke while they were in use."""
+
+    def __init__(self, bridge: Bridge, min_size: int = 5, max_size: int = 20,
+                 java_class: str = 'org.micromanager.Studio'):
+        self.bridge = bridge
+        self.min_size = min_size
+        self.max_size = max_size
+        self.java_class = java_class
+
+        self._lock = threading.Condition()
+        self._idle = []
+        self._in_use = set()
+        # The Java objects the sockets were made for, calls on them use the socket
+        self._providers = {}
+        self._growing = 0
+        self._closed = False
+
+        # Utilization counters
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time = 0.
+        self.created = 0
+        self.recycled = 0
+        self.peak_in_use = 0
+
+        for _ in range(self.min_size):
+            self._idle.append(self._new_socket())
+
+    def _new_socket(self):
+        socket_provider = self.bridge._construct_java_object(self.java_class, new_socket=True)
+        self.created += 1
+        self._providers[socket_provider._socket] = socket_provider
+        return socket_provider._socket
+
+    def provider(self, socket):
+        """ The java_class object of a checked out socket, e.g. to get at the Studio without
+        using the main socket of the bridge """
+        return self._providers[socket]
+
+    @property
+    def size(self):
+        return len(self._idle) + len(self._in_use) + self._growing
+
+    def checkout(self, timeout: float = None):
+        """ Get an idle socket, create a new one if all are busy and the pool can still grow or
+        wait for one to be checked in otherwise."""
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('Socket pool is closed')
+            grow = False
+            if not self._idle and self.size >= self.max_size:
+                self.waits += 1
+                t0 = time.perf_counter()
+                if not self._lock.wait_for(lambda: self._idle or self.size < self.max_size
+                                           or self._closed, timeout):
+                    raise TimeoutError('No idle socket available in the pool')
+                self.wait_time += time.perf_counter() - t0
+                if self._closed:
+                    raise RuntimeError('Socket pool is closed')
+            if self._idle:
+                socket = self._idle.pop()
+            else:
+                # Reserve the slot, the socket is constructed outside of the lock
+                grow = True
+                socket = None
+                self._growing += 1
+            self.checkouts += 1
+
+        if grow:
+            try:
+                socket = self._new_socket()
+            finally:
+                with self._lock:
+                    self._growing -= 1
+                    if socket is not None:
+                        self._in_use.add(socket)
+                    self._lock.notify()
+        else:
+            if not self._healthy(socket):
+                self._close_socket(socket)
+                self.recycled += 1
+                socket = self._new_socket()
+            with self._lock:
+                self._in_use.add(socket)
+
+        with self._lock:
+            self.peak_in_use = max(self.peak_in_use, len(self._in_use))
+        return socket
+
+    def checkin(self, socket, broken: bool = False):
+        """ Return a socket to the pool. Broken sockets are closed and dropped, the pool refills
+        them on the next checkout."""
+        with self._lock:
+            self._in_use.discard(socket)
+            if broken or not self._healthy(socket):
+                self.recycled += 1
+                self._close_socket(socket)
+            elif self._closed:
+                self._close_socket(socket)
+            else:
+                self._idle.append(socket)
+            self._lock.notify()
+
+    @contextmanager
+    def socket(self, timeout: float = None):
+        """ Check out a socket for the duration of a with block. Errors from zmq or a timeout of
+        the Java side mark the socket as broken."""
+        socket = self.checkout(timeout)
+        broken = False
+        try:
+            yield socket
+        except (zmq.ZMQError, TimeoutError):
+            broken = True
+            raise
+        finally:
+            self.checkin(socket, broken=broken)
+
+    @staticmethod
+    def _healthy(socket):
+        # pycromanager's DataSocket sets _closed and drops the zmq socket when it is closed
+        if getattr(socket, '_closed', False):
+            return False
+        zmq_socket = getattr(socket, '_socket', None)
+        return zmq_socket is None or not zmq_socket.closed
+
+    def _close_socket(self, socket):
+        self._providers.pop(socket, None)
+        try:
+            socket.close()
+        except Exception as error:
+            log.warning("Could not close socket: %r", error)
+
+    def stats(self):
+        """ Utilization of the pool, e.g. to be printed when closing the program """
+        with self._lock:
+            return {'size': self.size,
+                    'idle': len(self._idle),
+                    'in_use': len(self._in_use),
+                    'peak_in_use': self.peak_in_use,
+                    'checkouts': self.checkouts,
+                    'waits': self.waits,
+                    'wait_time_s': self.wait_time,
+                    'created': self.created,
+                    'recycled': self.recycled}
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            sockets = self._idle + list(self._in_use)
+            self._idle = []
+            self._in_use = set()
+            self._lock.notify_all()
+        for socket in sockets:
+            self._close_socket(socket)
@@ -0,0 +1,126 @@
+""" Analysis of the spot images used for the alignment, see AlignmentView. """
+
+from typing import NamedTuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+MAX_PEAKS = 17
+
+
+def maximum_filter3(data: np.ndarray) -> np.ndarray:
+    """ Maximum over the 3x3 neighbourhood of each pixel, as two separable passes """
+    padded = np.pad(data, 1, mode='edge')
+    rows = np.maximum(np.maximum(padded[:, :-2], padded[:, 1:-1]), padded[:, 2:])
+    return np.maximum(np.maximum(rows[:-2], rows[1:-1]), rows[2:])
+
+
+def find_peaks(image: np.ndarray, min_distance: int = 20, threshold: float = 1.5,
+               border: int = None, max_peaks: int = MAX_PEAKS) -> np.ndarray:
+    """ Brightest local maxima above threshold times the mean of the image, at least min_distance
+    apart in x and y and further than border from the edges. Returns up to max_peaks (row, column)
+    pairs, brightest first. Like picking the brightest pixel and blanking min_distance around it
+    over and over, but with one pass over the image."""
+    border = min_distance if border is None else border
+    data = np.asarray(image)
+    candidates = data == maximum_filter3(data)
+    candidates &= data > threshold*data.mean()
+    candidates[:border + 1] = False
+    candidates[:, :border + 1] = False
+    candidates[data.shape[0] - border:] = False
+    candidates[:, data.shape[1] - border:] = False
+
+    rows, columns = np.nonzero(candidates)
+    rows, columns = rows.astype(np.int32), columns.astype(np.int32)
+    values = data[rows, columns].astype(np.float32)
+    peaks = []
+    # Non-maximum suppression, one step per peak that is found
+    while len(peaks) < max_peaks and values.size:
+        index = np.argmax(values)
+        if values[index] < 0:
+            break
+        peak = (rows[index], columns[index])
+        peaks.append(peak)
+        close = np.abs(rows - peak[0]) <= min_distance
+        close &= np.abs(columns - peak[1]) <= min_distance
+        values[close] = -1
+    return np.array(peaks, dtype=int).reshape(-1, 2)
+
+
+class SpotFits(NamedTuple):
+    """ Results for n spots, each field is an array of length n. Positions are in image pixels in
+    the convention of the crosshairs, widths and amplitudes are only set by a Gaussian fit."""
+    row: np.ndarray
+    column: np.ndarray
+    sigma_row: np.ndarray = None
+    sigma_column: np.ndarray = None
+    amplitude: np.ndarray = None
+    background: np.ndarray = None
+
+
+def spot_windows(image: np.ndarray, peaks: np.ndarray, half: int) -> np.ndarray:
+    """ The (2*half + 1) square windows around the peaks as one (n, size, size) array. The peaks
+    have to be at least half away from the edges, as find_peaks returns them."""
+    size = 2*half + 1
+    windows = sliding_window_view(np.asarray(image), (size, size))
+    peaks = np.asarray(peaks, dtype=int).reshape(-1, 2)
+    return windows[peaks[:, 0] - half, peaks[:, 1] - half]
+
+
+def fit_spots(image: np.ndarray, peaks: np.ndarray, half: int = 20, threshold: float = 1.5,
+              gaussian: bool = False, fit_half: int = 6) -> SpotFits:
+    """ Centroids of all spots at once. Pixels below threshold times the mean of their window are
+    ignored, as for the center of mass used before. With gaussian, the width and amplitude of a 2D
+    Gaussian are estimated from the second moments above the background in the fit_half box
+    around each peak."""
+    peaks = np.asarray(peaks, dtype=int).reshape(-1, 2)
+    if not len(peaks):
+        empty = np.zeros(0)
+        return SpotFits(empty, empty, *([empty]*4 if gaussian else []))
+    windows = spot_windows(image, peaks, half).astype(np.float32)
+    means = windows.mean(axis=(1, 2), keepdims=True)
+    weights = np.where(windows < means*threshold, 0, windows)
+    coords = np.arange(2*half + 1, dtype=np.float32)
+    totals = weights.sum(axis=(1, 2))
+    totals[totals == 0] = np.nan
+    row = (weights.sum(axis=2) @ coords)/totals
+    column = (weights.sum(axis=1) @ coords)/totals
+    # Same position convention as the center of mass in AlignmentView before
+    fits = SpotFits(peaks[:, 0] + row - (half - 0.5), peaks[:, 1] + column - (half - 0.5))
+    if not gaussian:
+        return fits
+
+    # Background from the edge of each window, the spots are in the middle
+    edges = np.concatenate([windows[:, 0], windows[:, -1], windows[:, 1:-1, 0],
+                            windows[:, 1:-1, -1]], axis=1)
+    background = np.median(edges, axis=1)
+    # Moments without a threshold, that would cut off the tails, but close to the peak, where
+    # the noise of the background does not add up much
+    box = np.s_[:, half - fit_half:half + fit_half + 1, half - fit_half:half + fit_half + 1]
+    signal = windows[box] - background[:, None, None]
+    coords = np.arange(2*fit_half + 1, dtype=np.float32)
+    totals = signal.sum(axis=(1, 2))
+    totals[totals <= 0] = np.nan
+    profile_row, profile_column = signal.sum(axis=2), signal.sum(axis=1)
+    mean_row = (profile_row @ coords)/totals
+    mean_column = (profile_column @ coords)/totals
+    var_row = (profile_row @ coords**2)/totals - mean_row**2
+    var_column = (profile_column @ coords**2)/totals - mean_column**2
+    sigma_row = np.sqrt(np.where(var_row > 0, var_row, np.nan))
+    sigma_column = np.sqrt(np.where(var_column > 0, var_column, np.nan))
+    amplitude = totals/(2*np.pi*sigma_row*sigma_column)
+    return fits._replace(sigma_row=sigma_row, sigma_column=sigma_column, amplitude=amplitude,
+                         background=background)
+
+
+def alignment_quality(fits: SpotFits) -> dict:
+    """ How sharp and how even the spots are. For a good alignment the widths are small and
+    the same over the field, the spots round and the amplitudes similar."""
+    if fits.sigma_row is None or not len(fits.row):
+        return {}
+    sigma = np.sqrt(fits.sigma_row*fits.sigma_column)
+    return {'spots': int(len(fits.row)),
+            'sigma': float(np.nanmean(sigma)),
+            'sigma_cv': float(np.nanstd(sigma)/np.nanmean(sigma)),
+            'ellipticity': float(np.nanmean(np.abs(np.log(fits.sigma_row/fits.sigma_column)))),
+            'amplitude_cv': float(np.nanstd(fits.amplitude)/np.nanmean(fits.amplitude))}
@@ -0,0 +1,49 @@
+""" Timing of the program start. Every step of main() runs in a phase, phases can also run in other
+threads, the report shows when each one started and how long it took."""
+
+import threading
+import time
+from contextlib import contextmanager
+
+from logger import get_logger
+
+log = get_logger("startup")
+
+
+class StartupTimer:
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self._lock = threading.Lock()
+        # (name, start, duration, thread name) relative to t0
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            with self._lock:
+                self.phases.append((name, start - self.t0, duration,
+                                    threading.current_thread().name))
+            log.info("%s took %.2f s", name, duration)
+
+    def timed(self, name: str, function):
+        """ Wrap function to run it in a phase, e.g. when it is submitted to an executor """
+        def run(*args, **kwargs):
+            with self.phase(name):
+                return function(*args, **kwargs)
+        return run
+
+    def report(self) -> str:
+        total = time.perf_counter() - self.t0
+        with self._lock:
+            phases = sorted(self.phases, key=lambda phase: phase[1])
+        lines = [f"{'phase':28} {'start s':>8} {'took s':>8}  thread"]
+        for name, start, duration, thread in phases:
+            lines.append(f"{name:28} {start:8.2f} {duration:8.2f}  {thread}")
+        lines.append(f"{'total':28} {'':8} {total:8.2f}")
+        report = '\n'.join(lines)
+        log.info("Startup\n%s", report)
+        return report